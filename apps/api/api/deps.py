@@ -1,11 +1,14 @@
 """
 MedXrayChat Backend - API Dependencies
 """
+import hashlib
 from typing import Annotated, Optional
-from fastapi import Depends, HTTPException, status
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm import raiseload
 
 from core.database import get_db
 from core.security import decode_access_token, TokenData
@@ -14,36 +17,77 @@ from models import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# Short-lived cache of verified token payloads keyed by token hash. Only the
+# decoded claims are cached; the user row is always read fresh, so profile
+# updates and deactivation take effect on the next request.
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+
+def _token_cache_key(token: str) -> str:
+    """Hash the raw bearer token so it is never kept in memory as-is."""
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+def decode_token_cached(token: str) -> Optional[TokenData]:
+    """Decode a JWT, reusing a verified result for the cache TTL.
+
+    Used directly by the WebSocket handlers, which authenticate via a query
+    parameter and so cannot go through ``get_current_user``.
+    """
+    key = _token_cache_key(token)
+    token_data = _token_cache.get(key)
+    if token_data is None:
+        token_data = decode_access_token(token)
+        if token_data is None or token_data.user_id is None:
+            return None
+        _token_cache[key] = token_data
+    return token_data
+
 
 async def get_current_user(
+    request: Request,
     token: Annotated[str, Depends(oauth2_scheme)],
     db: Annotated[AsyncSession, Depends(get_db)],
 ) -> User:
-    """Get current authenticated user from JWT token."""
+    """Get current authenticated user from JWT token.
+
+    The resolved user is memoized on ``request.state`` so other auth
+    dependencies in the same request reuse it instead of decoding again.
+    """
+    current_user = getattr(request.state, "current_user", None)
+    if current_user is not None:
+        return current_user
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    token_data = decode_access_token(token)
-    if token_data is None or token_data.user_id is None:
+    token_data = decode_token_cached(token)
+    if token_data is None:
         raise credentials_exception
-    
+
+    # Primary-key lookup per request. Handlers only read scalar columns off
+    # current_user; make any relationship access fail loudly instead of
+    # lazy loading
     result = await db.execute(
-        select(User).where(User.id == token_data.user_id)
+        select(User)
+        .options(raiseload("*"))
+        .where(User.id == token_data.user_id)
     )
     user = result.scalar_one_or_none()
-    
+
     if user is None:
         raise credentials_exception
-    
+
     if not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Inactive user"
         )
     
+    request.state.current_user = user
     return user
 
 
@@ -55,6 +99,7 @@ async def get_current_active_user(
 
 
 async def get_optional_user(
+    request: Request,
     token: Annotated[Optional[str], Depends(oauth2_scheme)] = None,
     db: Annotated[AsyncSession, Depends(get_db)] = None,
 ) -> Optional[User]:
@@ -63,7 +108,7 @@ async def get_optional_user(
         return None
     
     try:
-        return await get_current_user(token, db)
+        return await get_current_user(request, token, db)
     except HTTPException:
         return None
 
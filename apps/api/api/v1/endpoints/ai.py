@@ -1,17 +1,24 @@
 """
 MedXrayChat Backend - AI Analysis Endpoints
 """
+import os
 import uuid
 import asyncio
 import base64
-from functools import partial
+import tempfile
+from io import BytesIO
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, status, Request
-from fastapi.responses import Response
-from sqlalchemy import select
+from typing import Optional
+import numpy as np
+from PIL import Image as PILImage
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Request
+from pydantic import TypeAdapter
+from fastapi.responses import Response, FileResponse
+from sqlalchemy import select, bindparam, lambda_stmt
+from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
-from models import Image, AIResult, Study
+from models import Image, AIResult, Study, User
 from schemas import (
     AIAnalyzeRequest,
     AIAnalyzeResponse,
@@ -23,70 +30,132 @@ from api.deps import CurrentUser, DbSession
 from services import get_ai_service
 from services.yolo_service import get_yolo_service
 from services.executor import get_executor
+from core.config import settings
+from core.database import async_session_maker
 from core.rate_limit import limiter
 from core.image_utils import load_image_from_file
 
 
 router = APIRouter(prefix="/ai", tags=["AI Analysis"])
 
+# Model tag baked into heatmap cache filenames; bump when weights change
+HEATMAP_MODEL_VERSION = "yolo11l"
 
-@router.get("/test-image")
-async def test_image():
-    """Test endpoint that returns a simple PNG image."""
-    from PIL import Image
-    from io import BytesIO
-    import numpy as np
-    
-    # Create a simple red gradient image
+# Ownership-checked path lookup shared by the endpoints below; the lambda
+# form caches the compiled SQL so each call only binds parameters
+_owned_image_path_stmt = lambda_stmt(
+    lambda: select(Image.file_path)
+    .join(Study)
+    .where(Image.id == bindparam("image_id"), Study.user_id == bindparam("user_id"))
+)
+
+# Results and heatmaps only change when a new analysis or upload lands,
+# so clients may reuse them briefly and then revalidate with If-None-Match
+_CACHE_CONTROL = "private, max-age=60, must-revalidate"
+
+# Built once; validates a stored detection list in a single call
+_detections_adapter = TypeAdapter(list[Detection])
+
+
+def _heatmap_cache_path(image_id: uuid.UUID, file_path: Path) -> Path:
+    """Get the on-disk cache path for an image heatmap.
+
+    The key includes the source file mtime and model version so a
+    re-uploaded image or new weights never serve a stale heatmap.
+    """
+    mtime = int(file_path.stat().st_mtime)
+    return Path(settings.HEATMAP_CACHE_DIR) / f"{image_id}_{mtime}_{HEATMAP_MODEL_VERSION}.png"
+
+
+def _write_heatmap_cache(cache_path: Path, data: bytes) -> None:
+    """Atomically write heatmap bytes to the cache (tmpfile + rename)."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    except Exception as e:
+        logger.warning(f"Failed to cache heatmap: {e}")
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, cache_path)
+    except Exception as e:
+        logger.warning(f"Failed to cache heatmap: {e}")
+        # Don't leave the partial temp file behind in the cache dir
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+
+
+def _build_test_png() -> bytes:
+    """Build a simple semi-transparent red PNG used by the test endpoint."""
     arr = np.zeros((100, 100, 4), dtype=np.uint8)
     arr[:, :, 0] = 255  # Red
     arr[:, :, 3] = 128  # Alpha
     
-    img = Image.fromarray(arr, 'RGBA')
     buf = BytesIO()
-    img.save(buf, format='PNG')
-    png_bytes = buf.getvalue()
-    
-    logger.info(f"Test image: {len(png_bytes)} bytes")
-    
+    PILImage.fromarray(arr, 'RGBA').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+# Deterministic fixture, encoded once at import
+_TEST_PNG_BYTES = _build_test_png()
+
+
+@router.get("/test-image")
+async def test_image():
+    """Test endpoint that returns a simple PNG image."""
     return Response(
-        content=png_bytes,
+        content=_TEST_PNG_BYTES,
         media_type="image/png",
     )
 
 
-@router.post("/analyze", response_model=AIAnalyzeResponse)
-@limiter.limit("10/minute")
-async def analyze_image(
-    request: Request,
-    analyze_request: AIAnalyzeRequest,
-    current_user: CurrentUser,
-    db: DbSession,
-) -> AIAnalyzeResponse:
-    """Run full AI analysis pipeline on an image.
-    
-    Pipeline:
-    1. YOLO detection for bounding boxes
-    2. Qwen-VL for detailed analysis
-    3. WBF fusion of results
+async def _persist_ai_result(payload: dict) -> None:
+    """Store an AIResult after the response has been sent.
+
+    Uses its own session; the request session is already closed by now.
     """
-    # Get image and verify ownership
-    image_query = (
-        select(Image)
-        .join(Study)
-        .where(Image.id == analyze_request.image_id, Study.user_id == current_user.id)
+    try:
+        async with async_session_maker() as session:
+            session.add(AIResult(**payload))
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Failed to persist AI result for image {payload.get('image_id')}: {e}")
+
+
+async def _run_analysis(
+    image_id: uuid.UUID,
+    run_yolo: bool,
+    run_qwen: bool,
+    question: Optional[str],
+    current_user: User,
+    db: AsyncSession,
+    background_tasks: BackgroundTasks,
+) -> AIAnalyzeResponse:
+    """Shared analysis core for /analyze and /detect."""
+    # Get image path and verify ownership in one projected query
+    result = await db.execute(
+        _owned_image_path_stmt,
+        {"image_id": image_id, "user_id": current_user.id},
     )
-    result = await db.execute(image_query)
-    image = result.scalar_one_or_none()
+    file_path = result.scalar_one_or_none()
 
-    if not image:
+    if not file_path:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
 
-    # Check if file exists
-    if not Path(image.file_path).exists():
+    # Decode off the event loop; a missing file surfaces as FileNotFoundError
+    # instead of paying for a separate exists() stat
+    loop = asyncio.get_running_loop()
+    try:
+        pil_image = await loop.run_in_executor(
+            get_executor(), load_image_from_file, file_path
+        )
+    except FileNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image file not found on disk"
@@ -96,38 +165,32 @@ async def analyze_image(
     ai_service = get_ai_service()
 
     try:
-        pil_image = load_image_from_file(image.file_path)
-
         # Run sync AI inference in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
         response = await loop.run_in_executor(
             get_executor(),
-            partial(
-                ai_service.analyze_image,
+            lambda: ai_service.analyze_image(
                 image=pil_image,
-                run_yolo=analyze_request.run_yolo,
-                run_qwen=analyze_request.run_qwen,
-                question=analyze_request.question,
-            )
+                run_yolo=run_yolo,
+                run_qwen=run_qwen,
+                question=question,
+            ),
         )
 
         # Set image_id on response
-        response.image_id = analyze_request.image_id
-
-        # Save results to database
-        ai_result = AIResult(
-            image_id=analyze_request.image_id,
-            yolo_detections=[d.model_dump() for d in response.yolo_detections],
-            qwen_detections=[d.model_dump() for d in response.qwen_detections],
-            fused_detections=[d.model_dump() for d in response.fused_detections],
-            analysis_text=response.analysis_text,
-            yolo_model_version="yolo11l-vindr",
-            qwen_model_version="Qwen3-VL-7B",
-            processing_time_ms=response.processing_time_ms,
-        )
-
-        db.add(ai_result)
-        await db.commit()
+        response.image_id = image_id
+
+        # Save results once the response is on its way to the client
+        background_tasks.add_task(_persist_ai_result, {
+            "image_id": image_id,
+            "user_id": current_user.id,
+            "yolo_detections": [d.model_dump() for d in response.yolo_detections],
+            "qwen_detections": [d.model_dump() for d in response.qwen_detections],
+            "fused_detections": [d.model_dump() for d in response.fused_detections],
+            "analysis_text": response.analysis_text,
+            "yolo_model_version": "yolo11l-vindr",
+            "qwen_model_version": "Qwen3-VL-7B",
+            "processing_time_ms": response.processing_time_ms,
+        })
 
         return response
 
@@ -141,17 +204,52 @@ async def analyze_image(
         )
 
 
+@router.post("/analyze", response_model=AIAnalyzeResponse)
+@limiter.limit("10/minute")
+async def analyze_image(
+    request: Request,
+    analyze_request: AIAnalyzeRequest,
+    background_tasks: BackgroundTasks,
+    current_user: CurrentUser,
+    db: DbSession,
+) -> AIAnalyzeResponse:
+    """Run full AI analysis pipeline on an image.
+    
+    Pipeline:
+    1. YOLO detection for bounding boxes
+    2. Qwen-VL for detailed analysis
+    3. WBF fusion of results
+    """
+    return await _run_analysis(
+        image_id=analyze_request.image_id,
+        run_yolo=analyze_request.run_yolo,
+        run_qwen=analyze_request.run_qwen,
+        question=analyze_request.question,
+        current_user=current_user,
+        db=db,
+        background_tasks=background_tasks,
+    )
+
+
 @router.post("/detect", response_model=AIAnalyzeResponse)
 @limiter.limit("15/minute")
 async def detect_only(
     request: Request,
     detect_request: AIAnalyzeRequest,
+    background_tasks: BackgroundTasks,
     current_user: CurrentUser,
     db: DbSession,
 ) -> AIAnalyzeResponse:
     """Run YOLO detection only (no Qwen-VL analysis)."""
-    detect_request.run_qwen = False
-    return await analyze_image(request, detect_request, current_user, db)
+    return await _run_analysis(
+        image_id=detect_request.image_id,
+        run_yolo=detect_request.run_yolo,
+        run_qwen=False,
+        question=detect_request.question,
+        current_user=current_user,
+        db=db,
+        background_tasks=background_tasks,
+    )
 
 
 @router.post("/chat", response_model=AIChatResponse)
@@ -167,37 +265,40 @@ async def chat_with_ai(
 
     if chat_request.image_id:
         # Get image and verify ownership
-        image_query = (
-            select(Image)
-            .join(Study)
-            .where(Image.id == chat_request.image_id, Study.user_id == current_user.id)
+        result = await db.execute(
+            _owned_image_path_stmt,
+            {"image_id": chat_request.image_id, "user_id": current_user.id},
         )
-        result = await db.execute(image_query)
-        image_record = result.scalar_one_or_none()
+        file_path = result.scalar_one_or_none()
 
-        if not image_record:
+        if not file_path:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Image not found"
             )
 
-        if Path(image_record.file_path).exists():
-            image = load_image_from_file(image_record.file_path)
+        # A missing file just means a text-only chat
+        loop = asyncio.get_running_loop()
+        try:
+            image = await loop.run_in_executor(
+                get_executor(), load_image_from_file, file_path
+            )
+        except FileNotFoundError:
+            image = None
 
     # Get AI response
     ai_service = get_ai_service()
 
     try:
         # Run sync AI inference in thread pool
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         response_text, detections, tokens = await loop.run_in_executor(
             get_executor(),
-            partial(
-                ai_service.chat,
+            lambda: ai_service.chat(
                 message=chat_request.message,
                 image=image,
                 include_detections=chat_request.include_detections,
-            )
+            ),
         )
 
         return AIChatResponse(
@@ -218,44 +319,52 @@ async def chat_with_ai(
 
 @router.get("/results/{image_id}", response_model=AIAnalyzeResponse)
 async def get_analysis_results(
+    request: Request,
+    response: Response,
     image_id: uuid.UUID,
     current_user: CurrentUser,
     db: DbSession,
 ) -> AIAnalyzeResponse:
     """Get cached AI analysis results for an image."""
-    # Verify ownership
-    image_query = (
-        select(Image)
-        .join(Study)
+    # Verify ownership and fetch the latest AI result in one round-trip
+    result_query = (
+        select(Image.id, AIResult)
+        .select_from(Image)
+        .join(Study, Image.study_id == Study.id)
+        .outerjoin(AIResult, AIResult.image_id == Image.id)
         .where(Image.id == image_id, Study.user_id == current_user.id)
+        .order_by(AIResult.created_at.desc())
+        .limit(1)
     )
-    result = await db.execute(image_query)
-    if not result.scalar_one_or_none():
+    result = await db.execute(result_query)
+    row = result.first()
+
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
     
-    # Get latest AI result
-    result_query = (
-        select(AIResult)
-        .where(AIResult.image_id == image_id)
-        .order_by(AIResult.created_at.desc())
-        .limit(1)
-    )
-    result = await db.execute(result_query)
-    ai_result = result.scalar_one_or_none()
-    
+    ai_result = row.AIResult
     if not ai_result:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No AI analysis results found for this image"
         )
     
+    etag = f'W/"{ai_result.id}-{int(ai_result.created_at.timestamp())}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers={"ETag": etag, "Cache-Control": _CACHE_CONTROL},
+        )
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = _CACHE_CONTROL
+    
     # Convert stored JSON back to Detection objects
-    yolo_dets = [Detection(**d) for d in ai_result.yolo_detections]
-    qwen_dets = [Detection(**d) for d in ai_result.qwen_detections]
-    fused_dets = [Detection(**d) for d in ai_result.fused_detections]
+    yolo_dets = _detections_adapter.validate_python(ai_result.yolo_detections)
+    qwen_dets = _detections_adapter.validate_python(ai_result.qwen_detections)
+    fused_dets = _detections_adapter.validate_python(ai_result.fused_detections)
     
     return AIAnalyzeResponse(
         image_id=image_id,
@@ -273,29 +382,32 @@ async def test_heatmap(image_id: uuid.UUID, current_user: CurrentUser, db: DbSes
     logger.info(f"Test heatmap for user: {current_user.id}, image: {image_id}")
     
     # Find the actual image from database
-    image_query = (
-        select(Image)
-        .join(Study)
-        .where(Image.id == image_id, Study.user_id == current_user.id)
+    result = await db.execute(
+        _owned_image_path_stmt,
+        {"image_id": image_id, "user_id": current_user.id},
     )
-    result = await db.execute(image_query)
-    image = result.scalar_one_or_none()
+    image_path = result.scalar_one_or_none()
     
-    if not image:
+    if not image_path:
         logger.error(f"Image not found: {image_id}")
         return Response(content=b"Image not found", status_code=404)
     
-    logger.info(f"Found image: {image.file_path}")
-    file_path = Path(image.file_path)
+    logger.info(f"Found image: {image_path}")
+    file_path = Path(image_path)
     
-    if not file_path.exists():
+    loop = asyncio.get_running_loop()
+    try:
+        image_bytes = await loop.run_in_executor(get_executor(), file_path.read_bytes)
+    except FileNotFoundError:
         logger.error(f"File not found: {file_path}")
         return Response(content=b"File not found", status_code=404)
-    
-    image_bytes = file_path.read_bytes()
     logger.info(f"Image bytes: {len(image_bytes)}")
 
-    heatmap_bytes = get_yolo_service().generate_heatmap(image_bytes)
+    heatmap_bytes = await loop.run_in_executor(
+        get_executor(),
+        get_yolo_service().generate_heatmap,
+        image_bytes,
+    )
     logger.info(f"Heatmap bytes: {len(heatmap_bytes)}")
     
     return Response(
@@ -321,39 +433,60 @@ async def get_heatmap(
     logger.info(f"Heatmap request for image_id: {image_id}, user: {current_user.id}")
     
     # Check image access
-    image_query = (
-        select(Image)
-        .join(Study)
-        .where(Image.id == image_id, Study.user_id == current_user.id)
+    result = await db.execute(
+        _owned_image_path_stmt,
+        {"image_id": image_id, "user_id": current_user.id},
     )
-    result = await db.execute(image_query)
-    image = result.scalar_one_or_none()
+    image_path = result.scalar_one_or_none()
     
-    if not image:
+    if not image_path:
         logger.error(f"Image not found: {image_id}")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
     
-    logger.info(f"Found image: {image.file_path}")
+    logger.info(f"Found image: {image_path}")
     
     # Load image bytes
-    file_path = Path(image.file_path)
-    if not file_path.exists():
+    file_path = Path(image_path)
+    try:
+        # The mtime stat doubles as the existence check
+        cache_path = _heatmap_cache_path(image_id, file_path)
+    except FileNotFoundError:
         logger.error(f"File not found on disk: {file_path}")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image file not found on disk"
         )
     
-    image_bytes = file_path.read_bytes()
+    # The cache key already encodes image, source mtime and model version
+    etag = f'W/"{cache_path.stem}"'
+    cache_headers = {"ETag": etag, "Cache-Control": _CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    
+    # Serve from disk cache if this image/model pair was already rendered
+    if cache_path.exists():
+        logger.info(f"Serving cached heatmap: {cache_path}")
+        return FileResponse(
+            path=str(cache_path),
+            media_type="image/png",
+            headers=cache_headers,
+        )
+    
+    loop = asyncio.get_running_loop()
+    image_bytes = await loop.run_in_executor(get_executor(), file_path.read_bytes)
     logger.info(f"Loaded image bytes: {len(image_bytes)} bytes from {file_path}")
     
     # Generate heatmap using GradCAM
     try:
         logger.info("Generating GradCAM heatmap...")
-        heatmap_bytes = get_yolo_service().generate_heatmap(image_bytes)
+        heatmap_bytes = await loop.run_in_executor(
+            get_executor(),
+            get_yolo_service().generate_heatmap,
+            image_bytes,
+        )
         logger.info(f"Heatmap generated: {len(heatmap_bytes)} bytes")
         
         if not heatmap_bytes or len(heatmap_bytes) == 0:
@@ -363,12 +496,14 @@ async def get_heatmap(
                 detail="Failed to generate heatmap: empty result"
             )
         
+        await loop.run_in_executor(
+            get_executor(), _write_heatmap_cache, cache_path, heatmap_bytes
+        )
+        
         return Response(
             content=heatmap_bytes,
             media_type="image/png",
-            headers={
-                "Cache-Control": "no-cache",
-            }
+            headers=cache_headers,
         )
     except HTTPException:
         raise
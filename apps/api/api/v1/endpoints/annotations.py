@@ -7,13 +7,13 @@ import uuid
 from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException, status
-from sqlalchemy import select
+from sqlalchemy import select, insert, delete, exists, bindparam, lambda_stmt
 from pydantic import BaseModel, Field
 
 from models import Image, Study
 from api.deps import CurrentUser, DbSession
 from core.database import Base
-from sqlalchemy import Column, String, Text, ForeignKey, DateTime, JSON
+from sqlalchemy import Column, String, Text, ForeignKey, DateTime, JSON, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime
@@ -28,7 +28,7 @@ class ImageAnnotation(Base):
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
     )
     image_id: Mapped[uuid.UUID] = mapped_column(
-        UUID(as_uuid=True), ForeignKey("images.id", ondelete="CASCADE"), index=True
+        UUID(as_uuid=True), ForeignKey("images.id", ondelete="CASCADE")
     )
     user_id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True
@@ -41,6 +41,14 @@ class ImageAnnotation(Base):
     )
 
 
+# Covers the per-image listing ordered by created_at
+Index(
+    "idx_image_annotations_image_created",
+    ImageAnnotation.image_id,
+    ImageAnnotation.created_at,
+)
+
+
 # Schemas
 class AnnotationCreate(BaseModel):
     """Schema for creating an annotation."""
@@ -71,6 +79,25 @@ class AnnotationBatchCreate(BaseModel):
 router = APIRouter(prefix="/annotations", tags=["Annotations"])
 
 
+# Compiled once; each ownership check only binds image_id/user_id
+_image_owned_stmt = lambda_stmt(
+    lambda: select(
+        exists().where(
+            Image.id == bindparam("image_id"),
+            Image.study_id == Study.id,
+            Study.user_id == bindparam("user_id"),
+        )
+    )
+)
+
+
+async def _image_owned_by(db, image_id: uuid.UUID, user_id: uuid.UUID) -> bool:
+    """Check image ownership with a bare EXISTS instead of loading the row."""
+    return await db.scalar(
+        _image_owned_stmt, {"image_id": image_id, "user_id": user_id}
+    )
+
+
 @router.post("", response_model=AnnotationResponse, status_code=status.HTTP_201_CREATED)
 async def create_annotation(
     annotation_in: AnnotationCreate,
@@ -79,12 +106,7 @@ async def create_annotation(
 ) -> AnnotationResponse:
     """Create a new annotation for an image."""
     # Verify image ownership
-    img_result = await db.execute(
-        select(Image)
-        .join(Study)
-        .where(Image.id == annotation_in.image_id, Study.user_id == current_user.id)
-    )
-    if not img_result.scalar_one_or_none():
+    if not await _image_owned_by(db, annotation_in.image_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
@@ -112,12 +134,7 @@ async def get_image_annotations(
 ) -> List[AnnotationResponse]:
     """Get all annotations for an image."""
     # Verify image ownership
-    img_result = await db.execute(
-        select(Image)
-        .join(Study)
-        .where(Image.id == image_id, Study.user_id == current_user.id)
-    )
-    if not img_result.scalar_one_or_none():
+    if not await _image_owned_by(db, image_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
@@ -139,32 +156,37 @@ async def create_annotations_batch(
 ) -> List[AnnotationResponse]:
     """Create multiple annotations for an image in one request."""
     # Verify image ownership
-    img_result = await db.execute(
-        select(Image)
-        .join(Study)
-        .where(Image.id == batch.image_id, Study.user_id == current_user.id)
-    )
-    if not img_result.scalar_one_or_none():
+    if not await _image_owned_by(db, batch.image_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
     
-    created = []
-    for ann_data in batch.annotations:
-        annotation = ImageAnnotation(
-            image_id=batch.image_id,
-            user_id=current_user.id,
-            annotation_type=ann_data.get("type", "unknown"),
-            annotation_data=ann_data,
-        )
-        db.add(annotation)
-        created.append(annotation)
+    if not batch.annotations:
+        return []
     
-    await db.commit()
+    # One multi-row INSERT ... RETURNING instead of a flush per annotation
+    now = datetime.utcnow()
+    stmt = (
+        insert(ImageAnnotation)
+        .values([
+            {
+                "id": uuid.uuid4(),
+                "image_id": batch.image_id,
+                "user_id": current_user.id,
+                "annotation_type": ann_data.get("type", "unknown"),
+                "annotation_data": ann_data,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for ann_data in batch.annotations
+        ])
+        .returning(ImageAnnotation)
+    )
+    result = await db.execute(stmt)
+    created = result.scalars().all()
     
-    for ann in created:
-        await db.refresh(ann)
+    await db.commit()
     
     return created
 
@@ -202,23 +224,14 @@ async def delete_all_image_annotations(
 ) -> None:
     """Delete all annotations for an image."""
     # Verify image ownership
-    img_result = await db.execute(
-        select(Image)
-        .join(Study)
-        .where(Image.id == image_id, Study.user_id == current_user.id)
-    )
-    if not img_result.scalar_one_or_none():
+    if not await _image_owned_by(db, image_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
     
-    result = await db.execute(
-        select(ImageAnnotation).where(ImageAnnotation.image_id == image_id)
+    # Single server-side DELETE instead of loading and deleting row by row
+    await db.execute(
+        delete(ImageAnnotation).where(ImageAnnotation.image_id == image_id)
     )
-    annotations = result.scalars().all()
-    
-    for ann in annotations:
-        await db.delete(ann)
-    
     await db.commit()
@@ -1,11 +1,13 @@
 """
 MedXrayChat Backend - Authentication Endpoints
 """
+import asyncio
 from datetime import timedelta
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select
+from pydantic import TypeAdapter
 from loguru import logger
 
 from core.database import get_db
@@ -23,6 +25,8 @@ from api.deps import CurrentUser, DbSession
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+_user_adapter = TypeAdapter(UserResponse)
+
 
 @router.post("/login", response_model=LoginResponse)
 @limiter.limit("5/minute")
@@ -38,7 +42,15 @@ async def login(
     )
     user = result.scalar_one_or_none()
 
-    if user is None or not verify_password(credentials.password, user.hashed_password):
+    # bcrypt is deliberately slow - keep it off the event loop, and off the
+    # AI executor so logins don't queue behind inference and chat streams
+    password_ok = False
+    if user is not None:
+        password_ok = await asyncio.to_thread(
+            verify_password, credentials.password, user.hashed_password
+        )
+
+    if not password_ok:
         # Log failed login attempt for security audit
         logger.warning(f"Failed login attempt for email: {credentials.email}")
         raise HTTPException(
@@ -66,7 +78,7 @@ async def login(
     return LoginResponse(
         access_token=access_token,
         token_type="bearer",
-        user=UserResponse.model_validate(user)
+        user=_user_adapter.validate_python(user, from_attributes=True)
     )
 
 
@@ -89,9 +101,10 @@ async def register(
         )
     
     # Create user
+    hashed_password = await asyncio.to_thread(get_password_hash, user_in.password)
     user = User(
         email=user_in.email,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=hashed_password,
         full_name=user_in.full_name,
         role="doctor",
     )
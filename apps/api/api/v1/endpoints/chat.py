@@ -2,14 +2,17 @@
 MedXrayChat Backend - Chat Endpoints with WebSocket
 """
 import uuid
+import time
 import asyncio
-import json
+import secrets
+from datetime import datetime
 from functools import partial
 from typing import List, Optional, AsyncGenerator
 from fastapi import APIRouter, HTTPException, status, WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy import select, func
-from pathlib import Path
+from cachetools import TTLCache
+import orjson
 from loguru import logger
 
 from models import ChatSession, ChatMessage, Image, Study
@@ -20,83 +23,279 @@ from schemas import (
     ChatMessageResponse,
     WSMessage,
 )
-from api.deps import CurrentUser, DbSession
+from api.deps import CurrentUser, DbSession, decode_token_cached
 from services import get_ai_service
 from services.executor import get_executor
+from core.config import settings
 from core.database import async_session_maker
-from core.security import decode_access_token
 from core.image_utils import load_image_from_file
 from core.streaming import (
     StreamingSession,
     create_sse_response_headers,
-    run_sync_generator_async,
 )
 
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
 
-async def get_session_detections(session_id: uuid.UUID, db) -> List:
-    """Get most recent detections from a chat session.
+def get_session_detections(messages: List) -> List:
+    """Get most recent detections from already-loaded chat messages.
 
     Args:
-        session_id: Chat session ID
-        db: Database session
+        messages: Session message rows (role, bbox_references) ordered by created_at
 
     Returns:
         List of Detection objects from most recent AI message with detections
     """
     from schemas import Detection
 
-    result = await db.execute(
-        select(ChatMessage)
-        .where(
-            ChatMessage.session_id == session_id,
-            ChatMessage.role == "assistant",
-            ChatMessage.bbox_references != None,
+    for message in reversed(messages):
+        if message.role == "assistant" and message.bbox_references:
+            try:
+                return [Detection(**d) for d in message.bbox_references]
+            except Exception as e:
+                logger.warning(f"Failed to parse existing detections: {e}")
+                return []
+    return []
+
+
+# session_id -> owner user_id; ownership never changes once a session exists
+_session_owner_cache: TTLCache = TTLCache(maxsize=10000, ttl=300)
+
+
+async def verify_session(session_id: uuid.UUID, user_id: uuid.UUID, db) -> bool:
+    """Check that a chat session belongs to the user, caching positive hits."""
+    if _session_owner_cache.get(session_id) == user_id:
+        return True
+
+    owned = await db.scalar(
+        select(ChatSession.id).where(
+            ChatSession.id == session_id, ChatSession.user_id == user_id
         )
+    )
+    if owned is None:
+        return False
+
+    _session_owner_cache[session_id] = user_id
+    return True
+
+
+async def get_chat_context(session_id: uuid.UUID, db) -> tuple[List[dict], List]:
+    """Load a session's recent history and its latest detections in one query.
+
+    Only the last CHAT_HISTORY_WINDOW messages are fetched, and only the
+    columns the AI context needs.
+
+    Returns:
+        (role/content history dicts, most recent assistant detections)
+    """
+    result = await db.execute(
+        select(ChatMessage.role, ChatMessage.content, ChatMessage.bbox_references)
+        .where(ChatMessage.session_id == session_id)
         .order_by(ChatMessage.created_at.desc())
-        .limit(1)
+        .limit(settings.CHAT_HISTORY_WINDOW)
     )
-    message = result.scalar_one_or_none()
+    messages = list(reversed(result.all()))
+    history = [
+        {"role": msg.role, "content": msg.content}
+        for msg in messages
+    ]
+    return history, get_session_detections(messages)
 
-    if message and message.bbox_references:
-        try:
-            return [Detection(**d) for d in message.bbox_references]
-        except Exception as e:
-            logger.warning(f"Failed to parse existing detections: {e}")
-            return []
-    return []
+
+async def load_image_async(file_path: str):
+    """Decode an image on the shared executor; None if the file is gone."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), load_image_from_file, file_path)
+    except FileNotFoundError:
+        logger.warning(f"Image file not found on disk: {file_path}")
+        return None
+
+
+async def load_message_image(image_id: Optional[uuid.UUID]):
+    """Fetch and decode a message's attached image on its own DB session.
+
+    A separate session lets this run concurrently with queries on the
+    request session.
+    """
+    if not image_id:
+        return None
+    async with async_session_maker() as image_db:
+        file_path = await image_db.scalar(
+            select(Image.file_path).where(Image.id == image_id)
+        )
+    if file_path is None:
+        return None
+    return await load_image_async(file_path)
+
+
+async def _watch_disconnect(
+    request: Request, disconnected: asyncio.Event, interval: float = 0.5
+) -> None:
+    """Poll the client connection and set ``disconnected`` once it drops."""
+    while not disconnected.is_set():
+        if await request.is_disconnected():
+            disconnected.set()
+            break
+        await asyncio.sleep(interval)
+
+
+# Per-session message count, correlated to the outer ChatSession row
+_message_count = (
+    select(func.count())
+    .select_from(ChatMessage)
+    .where(ChatMessage.session_id == ChatSession.id)
+    .correlate(ChatSession)
+    .scalar_subquery()
+    .label("message_count")
+)
+
+
+_REDIS_CONNECT_TIMEOUT = 2.0  # seconds
+_REDIS_RETRY_SECONDS = 30.0
 
 
 # Connection manager for WebSocket
 class ConnectionManager:
-    """Manages WebSocket connections for chat sessions."""
+    """Manages WebSocket connections for chat sessions.
+
+    Each connection gets an outbound queue drained by its own writer task,
+    so handlers enqueue pre-encoded frames and never wait on a slow socket.
+    Broadcasts are delivered to this worker's sockets directly and published
+    on Redis for sockets of the same session held by other workers; without
+    Redis, delivery is local only.
+    """
     
     def __init__(self):
         self.active_connections: dict[str, list[WebSocket]] = {}
+        self.out_queues: dict[WebSocket, asyncio.Queue] = {}
+        self._writers: dict[WebSocket, asyncio.Task] = {}
+        self._subscribers: dict[str, asyncio.Task] = {}
+        self._redis = None
+        self._redis_lock = asyncio.Lock()
+        self._redis_retry_at = 0.0
+        # Prefix on published frames so a worker skips its own broadcasts
+        self._origin = secrets.token_hex(4)
+    
+    @staticmethod
+    def _channel(session_id: str) -> str:
+        return f"medxray:chat:{session_id}"
+    
+    async def _get_redis(self):
+        """Lazily connect the async Redis client used for cross-worker fan-out.
+
+        Connection attempts are serialized and time-limited; after a failure
+        the next attempt waits _REDIS_RETRY_SECONDS.
+        """
+        if self._redis is not None or time.monotonic() < self._redis_retry_at:
+            return self._redis
+        async with self._redis_lock:
+            if self._redis is not None or time.monotonic() < self._redis_retry_at:
+                return self._redis
+            client = None
+            try:
+                import redis.asyncio as aioredis
+                client = aioredis.from_url(
+                    settings.REDIS_URL,
+                    decode_responses=True,
+                    socket_connect_timeout=_REDIS_CONNECT_TIMEOUT,
+                )
+                await asyncio.wait_for(client.ping(), _REDIS_CONNECT_TIMEOUT)
+                self._redis = client
+                logger.info(f"Chat pub/sub connected to Redis at {settings.REDIS_URL}")
+            except Exception as e:
+                logger.warning(f"Redis pub/sub unavailable: {e}. Broadcasting locally only.")
+                self._redis_retry_at = time.monotonic() + _REDIS_RETRY_SECONDS
+                if client is not None:
+                    await client.aclose()
+        return self._redis
     
     async def connect(self, websocket: WebSocket, session_id: str):
         await websocket.accept()
         if session_id not in self.active_connections:
             self.active_connections[session_id] = []
         self.active_connections[session_id].append(websocket)
+        queue: asyncio.Queue = asyncio.Queue()
+        self.out_queues[websocket] = queue
+        self._writers[websocket] = asyncio.create_task(self._writer_loop(websocket, queue))
+        # One subscription per session per worker, shared by its local sockets
+        if session_id not in self._subscribers and await self._get_redis() is not None:
+            self._subscribers[session_id] = asyncio.create_task(self._subscribe_loop(session_id))
         logger.info(f"WebSocket connected to session {session_id}")
     
     def disconnect(self, websocket: WebSocket, session_id: str):
-        if session_id in self.active_connections:
-            self.active_connections[session_id].remove(websocket)
-            if not self.active_connections[session_id]:
+        connections = self.active_connections.get(session_id)
+        if connections is not None and websocket in connections:
+            connections.remove(websocket)
+            if not connections:
                 del self.active_connections[session_id]
+                subscriber = self._subscribers.pop(session_id, None)
+                if subscriber is not None:
+                    subscriber.cancel()
+        self.out_queues.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None:
+            writer.cancel()
         logger.info(f"WebSocket disconnected from session {session_id}")
     
+    async def _writer_loop(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Send queued frames in order until the socket fails or is dropped."""
+        try:
+            while True:
+                payload = await queue.get()
+                await websocket.send_text(payload)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # The receive loop notices the closed socket and disconnects
+            logger.warning(f"WebSocket writer stopped: {e}")
+    
+    async def _subscribe_loop(self, session_id: str):
+        """Forward other workers' broadcasts for a session to this worker's sockets."""
+        pubsub = self._redis.pubsub()
+        origin_len = len(self._origin)
+        try:
+            await pubsub.subscribe(self._channel(session_id))
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                data = message["data"]
+                if data[:origin_len] != self._origin:
+                    self._deliver_local(session_id, data[origin_len:])
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Chat pub/sub for session {session_id} stopped: {e}")
+            # Let the next connect to this session resubscribe
+            if self._subscribers.get(session_id) is asyncio.current_task():
+                del self._subscribers[session_id]
+        finally:
+            await pubsub.aclose()
+    
+    def _enqueue(self, websocket: WebSocket, payload: str):
+        queue = self.out_queues.get(websocket)
+        if queue is not None:
+            queue.put_nowait(payload)
+    
+    def _deliver_local(self, session_id: str, payload: str):
+        for connection in self.active_connections.get(session_id, ()):
+            self._enqueue(connection, payload)
+    
     async def send_personal_message(self, message: dict, websocket: WebSocket):
-        await websocket.send_json(message)
+        self._enqueue(websocket, orjson.dumps(message).decode())
     
     async def broadcast(self, message: dict, session_id: str):
-        if session_id in self.active_connections:
-            for connection in self.active_connections[session_id]:
-                await connection.send_json(message)
+        # Encode once; each writer task only does the socket write. Local
+        # sockets never wait on (or depend on) Redis.
+        payload = orjson.dumps(message).decode()
+        self._deliver_local(session_id, payload)
+        redis = await self._get_redis()
+        if redis is not None:
+            try:
+                await redis.publish(self._channel(session_id), self._origin + payload)
+            except Exception as e:
+                logger.warning(f"Redis publish failed, other workers not notified: {e}")
 
 
 manager = ConnectionManager()
@@ -123,10 +322,8 @@ async def list_chat_sessions(
 ) -> List[ChatSessionResponse]:
     """List chat sessions for current user."""
     query = (
-        select(ChatSession, func.count(ChatMessage.id).label("message_count"))
-        .outerjoin(ChatMessage)
+        select(ChatSession, _message_count)
         .where(ChatSession.user_id == current_user.id)
-        .group_by(ChatSession.id)
         .order_by(ChatSession.updated_at.desc())
     )
     
@@ -165,6 +362,7 @@ async def create_chat_session(
     db.add(session)
     await db.commit()
     await db.refresh(session)
+    _session_owner_cache[session.id] = current_user.id
     
     return get_session_response(session, 0)
 
@@ -177,10 +375,8 @@ async def get_chat_session(
 ) -> ChatSessionResponse:
     """Get a specific chat session."""
     query = (
-        select(ChatSession, func.count(ChatMessage.id).label("message_count"))
-        .outerjoin(ChatMessage)
+        select(ChatSession, _message_count)
         .where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
-        .group_by(ChatSession.id)
     )
     
     result = await db.execute(query)
@@ -204,10 +400,7 @@ async def get_chat_messages(
 ) -> List[ChatMessage]:
     """Get all messages in a chat session."""
     # Verify session ownership
-    session_result = await db.execute(
-        select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
-    )
-    if not session_result.scalar_one_or_none():
+    if not await verify_session(session_id, current_user.id, db):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Chat session not found"
@@ -230,61 +423,42 @@ async def send_chat_message(
     db: DbSession,
 ) -> ChatMessageResponse:
     """Send a message and get AI response with tool calling support."""
-    # Verify session ownership
-    session_result = await db.execute(
-        select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
-    )
-    session = session_result.scalar_one_or_none()
-    if not session:
+    # Verify session ownership (cached after the first turn)
+    if not await verify_session(session_id, current_user.id, db):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Chat session not found"
         )
 
-    # Save user message
+    # History/detections and the attached image are independent; overlap
+    # the history query with the image lookup and decode
+    (history, existing_detections), image = await asyncio.gather(
+        get_chat_context(session_id, db),
+        load_message_image(message_in.image_id),
+    )
+
+    # Stage user message; it is committed together with the AI reply.
+    # Stamp it now: left to the column default, both rows would get their
+    # created_at in the same flush and could swap order in the history.
     user_message = ChatMessage(
         session_id=session_id,
         role="user",
         content=message_in.content,
         image_id=message_in.image_id,
+        created_at=datetime.utcnow(),
     )
     db.add(user_message)
-    await db.commit()
-
-    # Load image if provided
-    image = None
-    if message_in.image_id:
-        image_result = await db.execute(
-            select(Image).where(Image.id == message_in.image_id)
-        )
-        image_record = image_result.scalar_one_or_none()
-        if image_record and Path(image_record.file_path).exists():
-            image = load_image_from_file(image_record.file_path)
-
-    # Get chat history
-    history_result = await db.execute(
-        select(ChatMessage)
-        .where(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at)
-    )
-    history = [
-        {"role": msg.role, "content": msg.content}
-        for msg in history_result.scalars().all()
-    ]
-
-    # Get existing detections from session (for context)
-    existing_detections = await get_session_detections(session_id, db)
 
     # Get AI response with tool calling support
     ai_service = get_ai_service()
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
     response_text, detections, tokens, tool_call = await loop.run_in_executor(
         get_executor(),
         partial(
             ai_service.chat_with_tools,
             message=message_in.content,
             image=image,
-            chat_history=history[:-1],  # Exclude current message
+            chat_history=history,
             available_detections=existing_detections,
         )
     )
@@ -305,8 +479,8 @@ async def send_chat_message(
         tokens_used=tokens,
     )
     db.add(ai_message)
+    # id and created_at are client-side defaults, so no refresh is needed
     await db.commit()
-    await db.refresh(ai_message)
 
     return ai_message
 
@@ -335,50 +509,31 @@ async def send_chat_message_stream(
     - ping: Heartbeat for proxy compatibility
     - error: Error information
     """
-    # Verify session ownership
-    session_result = await db.execute(
-        select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == current_user.id)
-    )
-    session = session_result.scalar_one_or_none()
-    if not session:
+    # Verify session ownership (cached after the first turn)
+    if not await verify_session(session_id, current_user.id, db):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Chat session not found"
         )
 
-    # Save user message
+    # History/detections and the attached image are independent; overlap
+    # the history query with the image lookup and decode
+    (history, existing_detections), image = await asyncio.gather(
+        get_chat_context(session_id, db),
+        load_message_image(message_in.image_id),
+    )
+
+    # Stage user message; it is committed together with the AI reply.
+    # Stamp it now: left to the column default, both rows would get their
+    # created_at in the same flush and could swap order in the history.
     user_message = ChatMessage(
         session_id=session_id,
         role="user",
         content=message_in.content,
         image_id=message_in.image_id,
+        created_at=datetime.utcnow(),
     )
     db.add(user_message)
-    await db.commit()
-
-    # Load image if provided
-    image = None
-    if message_in.image_id:
-        image_result = await db.execute(
-            select(Image).where(Image.id == message_in.image_id)
-        )
-        image_record = image_result.scalar_one_or_none()
-        if image_record and Path(image_record.file_path).exists():
-            image = load_image_from_file(image_record.file_path)
-
-    # Get chat history
-    history_result = await db.execute(
-        select(ChatMessage)
-        .where(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at)
-    )
-    history = [
-        {"role": msg.role, "content": msg.content}
-        for msg in history_result.scalars().all()
-    ]
-
-    # Get existing detections from session
-    existing_detections = await get_session_detections(session_id, db)
 
     # Create streaming session
     stream_session = StreamingSession(
@@ -387,6 +542,8 @@ async def send_chat_message_stream(
         timeout=300.0,
     )
     ai_service = get_ai_service()
+    # Rough estimate (~4 chars/token); the Qwen stream does not report usage
+    input_tokens = len(message_in.content) // 4
 
     async def generate_tool_aware_stream() -> AsyncGenerator[str, None]:
         """Generate 2-phase SSE stream with tool calling support."""
@@ -396,28 +553,26 @@ async def send_chat_message_stream(
         content_block_idx = 0
         tool_was_used = False
         text_block_started = False
+        # One background poller instead of an ASGI receive per chunk
+        disconnected = asyncio.Event()
+        disconnect_watcher = asyncio.create_task(_watch_disconnect(request, disconnected))
 
         try:
             await stream_session.start()
 
             # Emit message_start
-            await stream_session.emit_message_start({
+            yield stream_session.emit_message_start({
                 "model": "qwen-vl-tools",
                 "user_id": str(current_user.id),
             })
 
             # Emit initial status so frontend knows we started
-            await stream_session.emit_status("started", "Đã nhận yêu cầu, đang bắt đầu xử lý...")
-
-            # Yield events immediately
-            while not stream_session.queue.empty():
-                event = await stream_session.queue.get()
-                if event:
-                    yield event.to_sse()
+            yield stream_session.emit_status("started", "Đã nhận yêu cầu, đang bắt đầu xử lý...")
 
-            # Use run_sync_generator_async for real-time streaming from sync generator
+            # Drive the sync generator on the shared AI executor and hand
+            # items back to the loop without allocating a future per chunk
             stream_queue: asyncio.Queue = asyncio.Queue()
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
 
             def run_sync_stream():
                 """Run sync generator and put results in queue."""
@@ -425,37 +580,38 @@ async def send_chat_message_stream(
                     gen = ai_service.chat_with_tools_stream(
                         message=message_in.content,
                         image=image,
-                        chat_history=history[:-1],
+                        chat_history=history,
                         available_detections=existing_detections,
                     )
                     for item in gen:
-                        asyncio.run_coroutine_threadsafe(
-                            stream_queue.put(("data", item)),
-                            loop
-                        )
-                    asyncio.run_coroutine_threadsafe(
-                        stream_queue.put(("done", None)),
-                        loop
-                    )
+                        loop.call_soon_threadsafe(stream_queue.put_nowait, ("data", item))
+                    loop.call_soon_threadsafe(stream_queue.put_nowait, ("done", None))
                 except Exception as e:
                     logger.error(f"Stream generator error: {e}")
-                    asyncio.run_coroutine_threadsafe(
-                        stream_queue.put(("error", str(e))),
-                        loop
-                    )
+                    loop.call_soon_threadsafe(stream_queue.put_nowait, ("error", str(e)))
 
-            # Start sync generator in thread
-            import concurrent.futures
-            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-            executor.submit(run_sync_stream)
+            get_executor().submit(run_sync_stream)
 
-            # Process stream events as they arrive
+            # Process stream events as they arrive, pinging while idle
+            idle_time = 0.0
             while True:
                 try:
-                    msg_type, data = await asyncio.wait_for(stream_queue.get(), timeout=300.0)
-                except asyncio.TimeoutError:
-                    logger.warning("Stream timeout")
-                    break
+                    # Items already buffered by the worker need no await or
+                    # timeout wrapper; only block when the queue is empty
+                    msg_type, data = stream_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    try:
+                        msg_type, data = await asyncio.wait_for(
+                            stream_queue.get(), timeout=stream_session.heartbeat_interval
+                        )
+                    except asyncio.TimeoutError:
+                        idle_time += stream_session.heartbeat_interval
+                        if idle_time >= stream_session.timeout:
+                            logger.warning("Stream timeout")
+                            break
+                        yield stream_session.emit_ping()
+                        continue
+                idle_time = 0.0
 
                 if msg_type == "done":
                     break
@@ -464,24 +620,24 @@ async def send_chat_message_stream(
 
                 event_type, content, detections = data
                 # Check if client disconnected
-                if await request.is_disconnected():
+                if disconnected.is_set():
                     logger.info(f"Client disconnected, stopping stream for session {session_id}")
                     break
 
                 if event_type == "thinking":
                     # Phase 1: Thinking indicator - emit simple status event
-                    await stream_session.emit_status("thinking", content)
+                    yield stream_session.emit_status("thinking", content)
 
                 elif event_type == "tool_start":
                     # Tool execution starting - emit status event
                     tool_was_used = True
-                    await stream_session.emit_status("analyzing", content)
+                    yield stream_session.emit_status("analyzing", content)
 
                 elif event_type == "tool_result":
                     # Tool finished - emit status with detections info
                     if detections:
                         final_detections = detections
-                        await stream_session.emit_status(
+                        yield stream_session.emit_status(
                             "analyzed",
                             content,
                             {
@@ -490,13 +646,13 @@ async def send_chat_message_stream(
                             }
                         )
                     else:
-                        await stream_session.emit_status("analyzed", content or "Hoàn tất phân tích")
+                        yield stream_session.emit_status("analyzed", content or "Hoàn tất phân tích")
 
                     # Now start generating text response
-                    await stream_session.emit_status("generating", "Đang tạo nội dung phản hồi...")
+                    yield stream_session.emit_status("generating", "Đang tạo nội dung phản hồi...")
 
                     # Start text content block for response
-                    await stream_session.emit_content_start(content_block_idx, "text")
+                    yield stream_session.emit_content_start(content_block_idx, "text")
                     text_block_started = True
 
                 elif event_type == "text":
@@ -504,101 +660,70 @@ async def send_chat_message_stream(
                     if not text_block_started:
                         # Emit generating status for direct response (no tool was used)
                         if not tool_was_used:
-                            await stream_session.emit_status("generating", "Đang tạo nội dung phản hồi...")
-                            # Yield status event immediately
-                            while not stream_session.queue.empty():
-                                event = await stream_session.queue.get()
-                                if event:
-                                    yield event.to_sse()
+                            yield stream_session.emit_status("generating", "Đang tạo nội dung phản hồi...")
 
                         # Start text block (either after tool or for direct response)
-                        await stream_session.emit_content_start(content_block_idx, "text")
+                        yield stream_session.emit_content_start(content_block_idx, "text")
                         text_block_started = True
 
                     full_response.append(content)
                     token_count += len(content) // 4
-                    await stream_session.emit_content_delta(content_block_idx, content, "text_delta")
+                    yield stream_session.emit_content_delta(content_block_idx, content, "text_delta")
 
                 elif event_type == "done":
                     # Stream finished
                     if detections:
                         final_detections = detections
 
-                # Yield events from queue immediately for real-time streaming
-                while not stream_session.queue.empty():
-                    event = await stream_session.queue.get()
-                    if event:
-                        yield event.to_sse()
-
-            # Clean up executor
-            executor.shutdown(wait=False)
-
             # Close text content block if started
             if text_block_started:
-                await stream_session.emit_content_stop(content_block_idx)
+                yield stream_session.emit_content_stop(content_block_idx)
 
-            # Emit remaining events
-            while not stream_session.queue.empty():
-                event = await stream_session.queue.get()
-                if event:
-                    yield event.to_sse()
-
-            # Save complete response to database
+            # Save complete response in the same transaction as the user message
             response_text = "".join(full_response)
-            async with async_session_maker() as save_db:
-                ai_message = ChatMessage(
-                    session_id=session_id,
-                    role="assistant",
-                    content=response_text,
-                    bbox_references=[d.model_dump() for d in final_detections],
-                    tokens_used=token_count,
-                )
-                save_db.add(ai_message)
-                await save_db.commit()
-                await save_db.refresh(ai_message)
-
-                # Emit message_delta with usage
-                await stream_session.emit_message_delta({
-                    "input_tokens": len(message_in.content) // 4,
-                    "output_tokens": token_count,
-                    "total_tokens": token_count + len(message_in.content) // 4,
-                })
-
-                # Emit complete status before message_stop
-                await stream_session.emit_status(
-                    "complete",
-                    "Hoàn tất xử lý",
-                    {
-                        "message_id": str(ai_message.id),
-                        "detections_count": len(final_detections),
-                        "tokens_used": token_count,
-                    }
-                )
+            ai_message = ChatMessage(
+                session_id=session_id,
+                role="assistant",
+                content=response_text,
+                bbox_references=[d.model_dump() for d in final_detections],
+                tokens_used=token_count,
+            )
+            db.add(ai_message)
+            await db.commit()
+
+            # Emit message_delta with usage
+            yield stream_session.emit_message_delta({
+                "input_tokens": input_tokens,
+                "output_tokens": token_count,
+                "total_tokens": token_count + input_tokens,
+            })
 
-                # Emit message_stop with final data
-                await stream_session.emit_message_stop({
+            # Emit complete status before message_stop
+            yield stream_session.emit_status(
+                "complete",
+                "Hoàn tất xử lý",
+                {
                     "message_id": str(ai_message.id),
                     "detections_count": len(final_detections),
-                    "tool_used": tool_was_used,
-                })
+                    "tokens_used": token_count,
+                }
+            )
 
-            # Yield final events
-            while not stream_session.queue.empty():
-                event = await stream_session.queue.get()
-                if event:
-                    yield event.to_sse()
+            # Emit message_stop with final data
+            yield stream_session.emit_message_stop({
+                "message_id": str(ai_message.id),
+                "detections_count": len(final_detections),
+                "tool_used": tool_was_used,
+            })
 
         except Exception as e:
             logger.error(f"Tool streaming error: {e}")
             import traceback
             logger.error(traceback.format_exc())
-            await stream_session.emit_error(str(e), "stream_error")
-            while not stream_session.queue.empty():
-                event = await stream_session.queue.get()
-                if event:
-                    yield event.to_sse()
+            yield stream_session.emit_error(str(e), "stream_error")
 
         finally:
+            disconnect_watcher.cancel()
             await stream_session.stop()
 
     return StreamingResponse(
@@ -624,20 +749,17 @@ async def websocket_chat(
         await websocket.close(code=4001, reason="Token required")
         return
 
-    token_data = decode_access_token(token)
+    token_data = decode_token_cached(token)
     if not token_data or not token_data.user_id:
         await websocket.close(code=4001, reason="Invalid or expired token")
         return
 
     # Verify session ownership
     async with async_session_maker() as db:
-        session_result = await db.execute(
-            select(ChatSession).where(
-                ChatSession.id == uuid.UUID(session_id),
-                ChatSession.user_id == uuid.UUID(token_data.user_id)
-            )
+        owned = await verify_session(
+            uuid.UUID(session_id), uuid.UUID(token_data.user_id), db
         )
-        if not session_result.scalar_one_or_none():
+        if not owned:
             await websocket.close(code=4003, reason="Session not found or unauthorized")
             return
 
@@ -656,37 +778,30 @@ async def websocket_chat(
                 content = data.get("content", "")
                 image_id = data.get("image_id")
 
-                # Process with AI
-                async with async_session_maker() as db:
-                    # Load image if provided
-                    image = None
-                    if image_id:
-                        result = await db.execute(
-                            select(Image).where(Image.id == uuid.UUID(image_id))
-                        )
-                        image_record = result.scalar_one_or_none()
-                        if image_record and Path(image_record.file_path).exists():
-                            image = load_image_from_file(image_record.file_path)
-
-                    # Get AI response
-                    ai_service = get_ai_service()
-                    loop = asyncio.get_event_loop()
-                    response_text, detections, tokens = await loop.run_in_executor(
-                        get_executor(),
-                        partial(
-                            ai_service.chat,
-                            message=content,
-                            image=image,
-                        )
+                # Load image if provided; the lookup session is released
+                # before inference instead of being held for the whole turn
+                image = await load_message_image(uuid.UUID(image_id) if image_id else None)
+
+                # Get AI response
+                ai_service = get_ai_service()
+                loop = asyncio.get_running_loop()
+                response_text, detections, tokens = await loop.run_in_executor(
+                    get_executor(),
+                    partial(
+                        ai_service.chat,
+                        message=content,
+                        image=image,
                     )
+                )
 
-                    # Send response back
-                    await manager.send_personal_message({
-                        "type": "chat_response",
-                        "content": response_text,
-                        "detections": [d.model_dump() for d in detections],
-                        "tokens_used": tokens,
-                    }, websocket)
+                # Send the response to every socket on this session, on
+                # any worker (e.g. the same chat open in another tab)
+                await manager.broadcast({
+                    "type": "chat_response",
+                    "content": response_text,
+                    "detections": [d.model_dump() for d in detections],
+                    "tokens_used": tokens,
+                }, session_id)
 
             elif message_type == "ping":
                 await manager.send_personal_message({"type": "pong"}, websocket)
@@ -5,7 +5,7 @@ from datetime import datetime
 from fastapi import APIRouter
 from sqlalchemy import select, func
 
-from models import Study, ChatSession, DiagnosisReport, Image, AIResult
+from models import Study, ChatSession, DiagnosisReport, AIResult
 from schemas import DashboardStatsResponse
 from api.deps import CurrentUser, DbSession
 
@@ -26,51 +26,41 @@ async def get_dashboard_stats(
     - Total chat sessions
     - Total diagnosis reports
     """
-    # Count total studies for user
-    total_studies = (
-        await db.execute(
-            select(func.count()).select_from(Study).where(
-                Study.user_id == current_user.id
-            )
-        )
-    ).scalar() or 0
-
-    # Count AI analyses done today (AIResult -> Image -> Study)
     today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    analyses_today = (
-        await db.execute(
-            select(func.count())
-            .select_from(AIResult)
-            .join(Image, AIResult.image_id == Image.id)
-            .join(Study, Image.study_id == Study.id)
-            .where(
-                Study.user_id == current_user.id,
-                AIResult.created_at >= today_start,
-            )
-        )
-    ).scalar() or 0
 
-    # Count chat sessions for user
-    chat_sessions = (
-        await db.execute(
-            select(func.count()).select_from(ChatSession).where(
-                ChatSession.user_id == current_user.id
-            )
+    # All four counts as scalar subqueries of one statement (one round-trip)
+    stats_query = select(
+        # Total studies for user
+        select(func.count())
+        .select_from(Study)
+        .where(Study.user_id == current_user.id)
+        .scalar_subquery(),
+        # AI analyses done today (indexed on user_id, created_at)
+        select(func.count())
+        .select_from(AIResult)
+        .where(
+            AIResult.user_id == current_user.id,
+            AIResult.created_at >= today_start,
         )
-    ).scalar() or 0
-
-    # Count diagnosis reports for user
-    reports = (
-        await db.execute(
-            select(func.count()).select_from(DiagnosisReport).where(
-                DiagnosisReport.user_id == current_user.id
-            )
-        )
-    ).scalar() or 0
+        .scalar_subquery(),
+        # Chat sessions for user
+        select(func.count())
+        .select_from(ChatSession)
+        .where(ChatSession.user_id == current_user.id)
+        .scalar_subquery(),
+        # Diagnosis reports for user
+        select(func.count())
+        .select_from(DiagnosisReport)
+        .where(DiagnosisReport.user_id == current_user.id)
+        .scalar_subquery(),
+    )
+    total_studies, analyses_today, chat_sessions, reports = (
+        await db.execute(stats_query)
+    ).one()
 
     return DashboardStatsResponse(
-        total_studies=total_studies,
-        analyses_today=analyses_today,
-        chat_sessions=chat_sessions,
-        reports=reports,
+        total_studies=total_studies or 0,
+        analyses_today=analyses_today or 0,
+        chat_sessions=chat_sessions or 0,
+        reports=reports or 0,
     )
@@ -4,9 +4,9 @@ MedXrayChat Backend - Model Versioning API Endpoints
 Manage model versions and A/B testing configuration.
 """
 import uuid
-from typing import List
+from typing import List, Tuple
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Request, Response
 
 from services.model_registry import (
     get_model_registry,
@@ -20,37 +20,33 @@ from api.deps import CurrentUser
 router = APIRouter(prefix="/models", tags=["Model Versioning"])
 
 
+def _json_response(request: Request, entry: Tuple[bytes, str]) -> Response:
+    """Serve a pre-serialized JSON body with its ETag, answering 304 on a match."""
+    body, etag = entry
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
 @router.get("", response_model=List[ModelVersionSchema])
 async def list_models(
+    request: Request,
     current_user: CurrentUser,
     model_type: str = None,
-) -> List[ModelVersionSchema]:
+) -> Response:
     """List all registered model versions."""
     registry = get_model_registry()
-    models = registry.list_models(model_type)
-    
-    return [
-        ModelVersionSchema(
-            id=m.id,
-            name=m.name,
-            model_type=m.model_type,
-            version=m.version,
-            is_active=m.is_active,
-            is_default=m.is_default,
-            traffic_weight=m.traffic_weight,
-            metadata=m.metadata,
-        )
-        for m in models
-    ]
+    return _json_response(request, registry.get_serialized_models(model_type))
 
 
 @router.get("/stats")
 async def get_registry_stats(
+    request: Request,
     current_user: CurrentUser,
-) -> dict:
+) -> Response:
     """Get model registry statistics."""
     registry = get_model_registry()
-    return registry.get_statistics()
+    return _json_response(request, registry.get_serialized_statistics())
 
 
 @router.post("/{model_id}/default")
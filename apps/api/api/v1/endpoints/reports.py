@@ -4,27 +4,74 @@ MedXrayChat Backend - Report Endpoints
 Provides diagnosis report generation with PDF export.
 """
 import uuid
+import asyncio
+from collections import defaultdict
+from statistics import fmean
 from typing import Optional
 from io import BytesIO
 from pathlib import Path
 from datetime import datetime
 
 from fastapi import APIRouter, HTTPException, status, Request
-from fastapi.responses import StreamingResponse
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from fastapi.responses import Response
+from sqlalchemy import select, insert, literal, false, Text
+from sqlalchemy.orm import selectinload, raiseload
 from loguru import logger
 
-from models import Study, DiagnosisReport, Image, AIResult
+from models import Study, DiagnosisReport
 from schemas import ReportCreate, ReportResponse
 from api.deps import CurrentUser, DbSession
 from services import get_ai_service
+from services.executor import get_executor
+from core.database import async_session_maker
 from core.rate_limit import limiter
 
 
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import cm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    
+    _PDF_FONT = "Helvetica"
+    # DejaVu covers Vietnamese diacritics; use it when the system provides it
+    _DEJAVU_PATH = Path("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+    if _DEJAVU_PATH.exists():
+        pdfmetrics.registerFont(TTFont("DejaVuSans", str(_DEJAVU_PATH)))
+        _PDF_FONT = "DejaVuSans"
+    
+    # Built once; paragraph styles are read-only during doc.build
+    _STYLES = getSampleStyleSheet()
+    _STYLES.add(ParagraphStyle(
+        name='Vietnamese',
+        fontName=_PDF_FONT,
+        fontSize=11,
+        leading=14,
+    ))
+    _HAS_REPORTLAB = True
+except ImportError:
+    _HAS_REPORTLAB = False
+
+
 router = APIRouter(prefix="/reports", tags=["Reports"])
 
 
+async def _run_parallel(*stmts) -> list:
+    """Run independent single-row SELECTs concurrently.
+
+    A single AsyncSession serializes statements, so each one gets its own
+    short-lived session (and pool connection).
+    """
+    async def _one(stmt):
+        async with async_session_maker() as session:
+            result = await session.execute(stmt)
+            return result.scalar_one_or_none()
+
+    return await asyncio.gather(*(_one(stmt) for stmt in stmts))
+
+
 @router.post("", response_model=ReportResponse, status_code=status.HTTP_201_CREATED)
 async def create_report(
     report_in: ReportCreate,
@@ -32,32 +79,44 @@ async def create_report(
     db: DbSession,
 ) -> ReportResponse:
     """Create or update a diagnosis report for a study."""
-    # Verify study ownership
-    study_result = await db.execute(
-        select(Study).where(Study.id == report_in.study_id, Study.user_id == current_user.id)
+    # INSERT ... SELECT FROM studies enforces ownership in the same statement:
+    # no row comes back unless the study belongs to the current user
+    result = await db.execute(
+        insert(DiagnosisReport)
+        .from_select(
+            ["study_id", "user_id", "findings", "impression", "recommendations", "is_ai_generated"],
+            select(
+                Study.id,
+                Study.user_id,
+                literal(report_in.findings, Text),
+                literal(report_in.impression, Text),
+                literal(report_in.recommendations, Text),
+                false(),
+            ).where(Study.id == report_in.study_id, Study.user_id == current_user.id),
+        )
+        .returning(DiagnosisReport)
     )
-    if not study_result.scalar_one_or_none():
+    report = result.scalar_one_or_none()
+    
+    if report is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Study not found"
         )
     
-    report = DiagnosisReport(
-        study_id=report_in.study_id,
-        user_id=current_user.id,
-        findings=report_in.findings,
-        impression=report_in.impression,
-        recommendations=report_in.recommendations,
-        is_ai_generated=False,
-    )
-    
-    db.add(report)
     await db.commit()
-    await db.refresh(report)
     
     return report
 
 
+_LATEST_RESULTS_SQL = """
+    SELECT DISTINCT ON (image_id) analysis_text, fused_detections
+    FROM ai_results
+    WHERE image_id = ANY($1::uuid[])
+    ORDER BY image_id, created_at DESC
+"""
+
+
 @router.post("/generate/{study_id}", response_model=ReportResponse)
 @limiter.limit("5/minute")
 async def generate_ai_report(
@@ -70,7 +129,7 @@ async def generate_ai_report(
     # Get study with images and AI results
     study_result = await db.execute(
         select(Study)
-        .options(selectinload(Study.images).selectinload(Image.ai_results))
+        .options(selectinload(Study.images).raiseload("*"), raiseload("*"))
         .where(Study.id == study_id, Study.user_id == current_user.id)
     )
     study = study_result.scalar_one_or_none()
@@ -87,17 +146,23 @@ async def generate_ai_report(
             detail="Study has no images to analyze"
         )
     
+    # Latest AI result per image (Postgres DISTINCT ON), read straight off
+    # asyncpg to skip SQLAlchemy result processing for this hot aggregate
+    conn = await db.connection()
+    raw_conn = await conn.get_raw_connection()
+    rows = await raw_conn.driver_connection.fetch(
+        _LATEST_RESULTS_SQL, [image.id for image in study.images]
+    )
+    
     # Collect all AI analysis results
     all_findings = []
     all_detections = []
     
-    for image in study.images:
-        if image.ai_results:
-            latest_result = sorted(image.ai_results, key=lambda r: r.created_at, reverse=True)[0]
-            if latest_result.analysis_text:
-                all_findings.append(latest_result.analysis_text)
-            if latest_result.fused_detections:
-                all_detections.extend(latest_result.fused_detections)
+    for analysis_text, fused_detections in rows:
+        if analysis_text:
+            all_findings.append(analysis_text)
+        if fused_detections:
+            all_detections.extend(fused_detections)
     
     # Generate report content using AI
     ai_service = get_ai_service()
@@ -108,18 +173,21 @@ async def generate_ai_report(
     recommendations = _generate_recommendations(all_detections)
     
     # Create report
-    report = DiagnosisReport(
-        study_id=study_id,
-        user_id=current_user.id,
-        findings=findings,
-        impression=impression,
-        recommendations=recommendations,
-        is_ai_generated=True,
+    result = await db.execute(
+        insert(DiagnosisReport)
+        .values(
+            study_id=study_id,
+            user_id=current_user.id,
+            findings=findings,
+            impression=impression,
+            recommendations=recommendations,
+            is_ai_generated=True,
+        )
+        .returning(DiagnosisReport)
     )
+    report = result.scalar_one()
     
-    db.add(report)
     await db.commit()
-    await db.refresh(report)
     
     return report
 
@@ -128,28 +196,22 @@ async def generate_ai_report(
 async def get_report(
     study_id: uuid.UUID,
     current_user: CurrentUser,
-    db: DbSession,
 ) -> ReportResponse:
     """Get the latest report for a study."""
-    # Verify study ownership
-    study_result = await db.execute(
-        select(Study).where(Study.id == study_id, Study.user_id == current_user.id)
+    # Ownership check and report lookup are independent; run them concurrently
+    owned_study_id, report = await _run_parallel(
+        select(Study.id).where(Study.id == study_id, Study.user_id == current_user.id),
+        select(DiagnosisReport)
+        .where(DiagnosisReport.study_id == study_id)
+        .order_by(DiagnosisReport.created_at.desc())
+        .limit(1),
     )
-    if not study_result.scalar_one_or_none():
+    if owned_study_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Study not found"
         )
     
-    # Get latest report
-    report_result = await db.execute(
-        select(DiagnosisReport)
-        .where(DiagnosisReport.study_id == study_id)
-        .order_by(DiagnosisReport.created_at.desc())
-        .limit(1)
-    )
-    report = report_result.scalar_one_or_none()
-    
     if not report:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -169,7 +231,7 @@ async def export_report_pdf(
     # Get report with study info
     report_result = await db.execute(
         select(DiagnosisReport)
-        .options(selectinload(DiagnosisReport.study))
+        .options(selectinload(DiagnosisReport.study).raiseload("*"), raiseload("*"))
         .where(DiagnosisReport.id == report_id)
     )
     report = report_result.scalar_one_or_none()
@@ -180,15 +242,21 @@ async def export_report_pdf(
             detail="Report not found"
         )
     
-    # Generate PDF
-    pdf_buffer = _generate_pdf(report)
+    # Generate PDF (ReportLab layout is CPU-bound; keep it off the event loop)
+    loop = asyncio.get_running_loop()
+    pdf_bytes = await loop.run_in_executor(get_executor(), _generate_pdf, report)
     
     filename = f"report_{report.study_id}_{datetime.now().strftime('%Y%m%d')}.pdf"
     
-    return StreamingResponse(
-        pdf_buffer,
+    # ReportLab only emits the file at save() (the xref table comes last), so
+    # send the finished bytes in one body instead of iterating the buffer
+    return Response(
+        pdf_bytes,
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "private, max-age=3600",
+        }
     )
 
 
@@ -199,17 +267,14 @@ def _generate_findings(detections: list, ai_texts: list) -> str:
     
     findings = []
     
-    # Group detections by class
-    detection_groups = {}
+    # Group confidences by class
+    confidence_groups = defaultdict(list)
     for det in detections:
-        cls_name = det.get("class_name", "Unknown")
-        if cls_name not in detection_groups:
-            detection_groups[cls_name] = []
-        detection_groups[cls_name].append(det)
+        confidence_groups[det.get("class_name", "Unknown")].append(det.get("confidence", 0.0))
     
     # Generate findings for each detected condition
-    for cls_name, dets in detection_groups.items():
-        avg_conf = sum(d.get("confidence", 0) for d in dets) / len(dets)
+    for cls_name, confs in confidence_groups.items():
+        avg_conf = fmean(confs)
         if avg_conf > 0.5:
             findings.append(f"- {cls_name}: Phát hiện với độ tin cậy {avg_conf:.0%}")
         else:
@@ -228,16 +293,28 @@ def _generate_impression(detections: list) -> str:
     if not detections:
         return "Hình ảnh X-quang phổi trong giới hạn bình thường."
     
-    # Count significant findings
-    high_conf = [d for d in detections if d.get("confidence", 0) > 0.5]
-    
-    if len(high_conf) == 0:
+    # Count significant findings, bailing out as soon as there are more than two
+    classes = set()
+    count = 0
+    for d in detections:
+        if d.get("confidence", 0) > 0.5:
+            count += 1
+            if count > 2:
+                return "Nhiều bất thường được phát hiện. Cần đánh giá lâm sàng chi tiết."
+            classes.add(d.get("class_name"))
+    
+    if count == 0:
         return "Một số dấu hiệu nghi ngờ cần theo dõi thêm."
-    elif len(high_conf) <= 2:
-        classes = list(set(d.get("class_name") for d in high_conf))
-        return f"Phát hiện {', '.join(classes)}. Đề nghị đối chiếu lâm sàng."
-    else:
-        return "Nhiều bất thường được phát hiện. Cần đánh giá lâm sàng chi tiết."
+    return f"Phát hiện {', '.join(classes)}. Đề nghị đối chiếu lâm sàng."
+
+
+# (class-name keywords, recommendation), checked in order against lowercased class names
+_RECOMMENDATION_TRIGGERS = (
+    (("nodule", "mass"), "- CT scan ngực để đánh giá chi tiết tổn thương"),
+    (("effusion",), "- Siêu âm ngực, xem xét chọc dịch nếu cần"),
+    (("pneumothorax",), "- Đánh giá lâm sàng khẩn, xem xét dẫn lưu nếu tràn khí lớn"),
+    (("cardiomegaly",), "- Siêu âm tim, ECG"),
+)
 
 
 def _generate_recommendations(detections: list) -> str:
@@ -247,16 +324,11 @@ def _generate_recommendations(detections: list) -> str:
     
     recommendations = ["Các đề xuất dựa trên kết quả phân tích AI:"]
     
-    classes = set(d.get("class_name") for d in detections)
+    lowered = {c.lower() for c in {d.get("class_name") for d in detections} if c}
     
-    if any("Nodule" in c or "Mass" in c for c in classes):
-        recommendations.append("- CT scan ngực để đánh giá chi tiết tổn thương")
-    if any("effusion" in c.lower() for c in classes):
-        recommendations.append("- Siêu âm ngực, xem xét chọc dịch nếu cần")
-    if any("Pneumothorax" in c for c in classes):
-        recommendations.append("- Đánh giá lâm sàng khẩn, xem xét dẫn lưu nếu tràn khí lớn")
-    if any("Cardiomegaly" in c for c in classes):
-        recommendations.append("- Siêu âm tim, ECG")
+    for keywords, recommendation in _RECOMMENDATION_TRIGGERS:
+        if any(kw in c for c in lowered for kw in keywords):
+            recommendations.append(recommendation)
     
     if len(recommendations) == 1:
         recommendations.append("- Tái khám và theo dõi tiến triển")
@@ -266,76 +338,11 @@ def _generate_recommendations(detections: list) -> str:
     return "\n".join(recommendations)
 
 
-def _generate_pdf(report: DiagnosisReport) -> BytesIO:
+def _generate_pdf(report: DiagnosisReport) -> bytes:
     """Generate PDF from report data."""
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import cm
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-        
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        
-        # Custom style for Vietnamese text
-        styles.add(ParagraphStyle(
-            name='Vietnamese',
-            fontName='Helvetica',
-            fontSize=11,
-            leading=14,
-        ))
-        
-        elements = []
-        
-        # Header
-        elements.append(Paragraph("<b>BÁO CÁO CHẨN ĐOÁN HÌNH ẢNH</b>", styles['Title']))
-        elements.append(Spacer(1, 0.5*cm))
-        
-        # Study info
-        study = report.study
-        elements.append(Paragraph(f"<b>Mã bệnh nhân:</b> {study.patient_id or 'N/A'}", styles['Vietnamese']))
-        elements.append(Paragraph(f"<b>Tên bệnh nhân:</b> {study.patient_name or 'N/A'}", styles['Vietnamese']))
-        elements.append(Paragraph(f"<b>Ngày khám:</b> {report.created_at.strftime('%d/%m/%Y')}", styles['Vietnamese']))
-        elements.append(Spacer(1, 0.5*cm))
-        
-        # Findings
-        elements.append(Paragraph("<b>KẾT QUẢ PHÂN TÍCH:</b>", styles['Heading2']))
-        if report.findings:
-            for line in report.findings.split('\n'):
-                elements.append(Paragraph(line, styles['Vietnamese']))
-        elements.append(Spacer(1, 0.3*cm))
-        
-        # Impression
-        elements.append(Paragraph("<b>KẾT LUẬN:</b>", styles['Heading2']))
-        if report.impression:
-            elements.append(Paragraph(report.impression, styles['Vietnamese']))
-        elements.append(Spacer(1, 0.3*cm))
-        
-        # Recommendations
-        elements.append(Paragraph("<b>ĐỀ XUẤT:</b>", styles['Heading2']))
-        if report.recommendations:
-            for line in report.recommendations.split('\n'):
-                elements.append(Paragraph(line, styles['Vietnamese']))
-        
-        # Footer
-        elements.append(Spacer(1, 1*cm))
-        if report.is_ai_generated:
-            elements.append(Paragraph(
-                "<i>*Báo cáo này được tạo bởi hệ thống AI. Kết quả cần được xác nhận bởi bác sĩ.*</i>",
-                styles['Vietnamese']
-            ))
-        
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer
-        
-    except ImportError:
+    if not _HAS_REPORTLAB:
         logger.warning("reportlab not installed, returning simple text PDF")
         # Fallback: return simple text
-        buffer = BytesIO()
         content = f"""
 DIAGNOSIS REPORT
 ================
@@ -351,6 +358,50 @@ IMPRESSION:
 RECOMMENDATIONS:
 {report.recommendations or 'N/A'}
 """
-        buffer.write(content.encode('utf-8'))
-        buffer.seek(0)
-        return buffer
+        return content.encode('utf-8')
+    
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    
+    elements = []
+    
+    # Header
+    elements.append(Paragraph("<b>BÁO CÁO CHẨN ĐOÁN HÌNH ẢNH</b>", _STYLES['Title']))
+    elements.append(Spacer(1, 0.5*cm))
+    
+    # Study info
+    study = report.study
+    elements.append(Paragraph(f"<b>Mã bệnh nhân:</b> {study.patient_id or 'N/A'}", _STYLES['Vietnamese']))
+    elements.append(Paragraph(f"<b>Tên bệnh nhân:</b> {study.patient_name or 'N/A'}", _STYLES['Vietnamese']))
+    elements.append(Paragraph(f"<b>Ngày khám:</b> {report.created_at.strftime('%d/%m/%Y')}", _STYLES['Vietnamese']))
+    elements.append(Spacer(1, 0.5*cm))
+    
+    # Findings
+    elements.append(Paragraph("<b>KẾT QUẢ PHÂN TÍCH:</b>", _STYLES['Heading2']))
+    if report.findings:
+        for line in report.findings.split('\n'):
+            elements.append(Paragraph(line, _STYLES['Vietnamese']))
+    elements.append(Spacer(1, 0.3*cm))
+    
+    # Impression
+    elements.append(Paragraph("<b>KẾT LUẬN:</b>", _STYLES['Heading2']))
+    if report.impression:
+        elements.append(Paragraph(report.impression, _STYLES['Vietnamese']))
+    elements.append(Spacer(1, 0.3*cm))
+    
+    # Recommendations
+    elements.append(Paragraph("<b>ĐỀ XUẤT:</b>", _STYLES['Heading2']))
+    if report.recommendations:
+        for line in report.recommendations.split('\n'):
+            elements.append(Paragraph(line, _STYLES['Vietnamese']))
+    
+    # Footer
+    elements.append(Spacer(1, 1*cm))
+    if report.is_ai_generated:
+        elements.append(Paragraph(
+            "<i>*Báo cáo này được tạo bởi hệ thống AI. Kết quả cần được xác nhận bởi bác sĩ.*</i>",
+            _STYLES['Vietnamese']
+        ))
+    
+    doc.build(elements)
+    return buffer.getvalue()
@@ -5,17 +5,18 @@ Provides real-time token-by-token streaming for AI responses via WebSocket.
 """
 import uuid
 import asyncio
-from typing import Optional, AsyncGenerator
-from pathlib import Path
-from functools import partial
+from dataclasses import dataclass
+from typing import Optional, AsyncGenerator, Union
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from sqlalchemy import select
 from loguru import logger
+import orjson
+import msgpack
 
 from models import Image, ChatSession
+from api.deps import decode_token_cached
 from core.database import async_session_maker
-from core.security import decode_access_token
 from core.image_utils import load_image_from_file
 from services import get_ai_service
 from services.executor import get_executor
@@ -25,6 +26,27 @@ from PIL import Image as PILImage
 router = APIRouter(prefix="/ai", tags=["AI Streaming"])
 
 
+@dataclass(frozen=True, slots=True)
+class TokenChunk:
+    """A piece of generated text."""
+    text: str
+
+
+@dataclass(frozen=True, slots=True)
+class StreamEnd:
+    """Generation finished."""
+    tokens: int
+
+
+@dataclass(frozen=True, slots=True)
+class StreamError:
+    """Generation failed."""
+    message: str
+
+
+StreamItem = Union[TokenChunk, StreamEnd, StreamError]
+
+
 class StreamingAIService:
     """Service for streaming AI responses token by token."""
     
@@ -36,41 +58,84 @@ class StreamingAIService:
         message: str,
         image: Optional[PILImage.Image] = None,
         chat_history: Optional[list] = None,
-    ) -> AsyncGenerator[str, None]:
+        flush_bytes: int = 64,
+        flush_interval: float = 0.010,
+    ) -> AsyncGenerator[StreamItem, None]:
         """Stream AI response token by token.
         
+        Tokens are coalesced until ``flush_bytes`` characters are buffered or
+        ``flush_interval`` seconds have passed since the first buffered one,
+        so each websocket frame carries more than a single token.
+        
         Yields:
-            Individual tokens or text chunks
+            TokenChunk for text, then a single StreamEnd or StreamError
         """
-        try:
-            # Get the full response first (for now, simulating streaming)
-            # In production, you'd use a model that supports actual streaming
-            loop = asyncio.get_event_loop()
-            response_text, detections, tokens = await loop.run_in_executor(
-                get_executor(),
-                partial(
-                    self.ai_service.chat,
+        queue: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def produce() -> None:
+            """Run YOLO + Qwen streaming in a worker thread, pushing chunks to the queue."""
+            try:
+                stream, _ = self.ai_service.chat_stream(
                     message=message,
                     image=image,
                     chat_history=chat_history,
                 )
-            )
-            
-            # Simulate streaming by yielding chunks
-            chunk_size = 20  # characters per chunk
-            for i in range(0, len(response_text), chunk_size):
-                chunk = response_text[i:i + chunk_size]
-                yield chunk
-                await asyncio.sleep(0.02)  # Small delay for streaming effect
-            
-            # Yield final metadata
-            yield f"\n[STREAM_END:tokens={tokens}]"
-            
-        except Exception as e:
-            logger.error(f"Streaming error: {e}")
-            yield f"\n[STREAM_ERROR:{str(e)[:50]}]"
+                tokens = 0
+                for chunk in stream:
+                    tokens += 1
+                    loop.call_soon_threadsafe(queue.put_nowait, ("data", chunk))
+                loop.call_soon_threadsafe(queue.put_nowait, ("done", tokens))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+        get_executor().submit(produce)
 
+        buf: list[str] = []
+        buf_len = 0
+        deadline = 0.0
 
+        while True:
+            if not buf:
+                kind, payload = await queue.get()
+            else:
+                remaining = deadline - loop.time()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    kind, payload = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    yield TokenChunk("".join(buf))
+                    buf.clear()
+                    buf_len = 0
+                    continue
+
+            if kind == "data":
+                if not buf:
+                    deadline = loop.time() + flush_interval
+                buf.append(payload)
+                buf_len += len(payload)
+                if buf_len >= flush_bytes:
+                    yield TokenChunk("".join(buf))
+                    buf.clear()
+                    buf_len = 0
+                continue
+
+            # Flush the tail before the end/error marker
+            if buf:
+                yield TokenChunk("".join(buf))
+                buf.clear()
+            if kind == "done":
+                # Streamer yields roughly one token per chunk
+                yield StreamEnd(payload)
+                break
+            else:
+                logger.error(f"Streaming error: {payload}")
+                yield StreamError(str(payload)[:50])
+                break
+
+
+# Created lazily, or at startup by main._preload_ai_models when PRELOAD_AI_MODELS is set
 _streaming_service: Optional[StreamingAIService] = None
 
 
@@ -81,11 +146,39 @@ def get_streaming_service() -> StreamingAIService:
     return _streaming_service
 
 
+# Frame type -> (msgpack type code, JSON field carrying the value)
+_FRAME_TYPES = {
+    "token": (0, "content"),
+    "complete": (1, "tokens_used"),
+    "error": (2, "message"),
+    "pong": (3, None),
+}
+
+
+def _make_sender(websocket: WebSocket, codec: str):
+    """Return ``send(frame_type, value)`` for the negotiated wire codec.
+
+    json (default): text frames ``{"type": ..., <field>: value}`` via orjson.
+    msgpack: binary frames ``[type_code, value]``.
+    """
+    if codec == "msgpack":
+        async def send(frame_type: str, value=None) -> None:
+            code, _ = _FRAME_TYPES[frame_type]
+            await websocket.send_bytes(msgpack.packb((code, value), use_bin_type=True))
+    else:
+        async def send(frame_type: str, value=None) -> None:
+            _, field = _FRAME_TYPES[frame_type]
+            payload = {"type": frame_type, field: value} if field else {"type": frame_type}
+            await websocket.send_text(orjson.dumps(payload).decode())
+    return send
+
+
 @router.websocket("/stream/{session_id}")
 async def stream_ai_response(
     websocket: WebSocket,
     session_id: str,
     token: Optional[str] = Query(None),
+    codec: str = Query("json"),
 ):
     """WebSocket endpoint for streaming AI responses.
     
@@ -95,6 +188,9 @@ async def stream_ai_response(
     3. Server streams: {"type": "token", "content": "..."} for each token
     4. Server sends: {"type": "complete", "tokens_used": N} when done
     
+    With ?codec=msgpack, server frames are binary msgpack ``[code, value]``
+    (0=token, 1=complete, 2=error, 3=pong) instead of JSON text.
+    
     Example: ws://host/api/v1/ai/stream/{session_id}?token=<jwt>
     """
     # Auth
@@ -102,7 +198,7 @@ async def stream_ai_response(
         await websocket.close(code=4001, reason="Token required")
         return
     
-    token_data = decode_access_token(token)
+    token_data = decode_token_cached(token)
     if not token_data or not token_data.user_id:
         await websocket.close(code=4001, reason="Invalid token")
         return
@@ -120,7 +216,11 @@ async def stream_ai_response(
             return
     
     await websocket.accept()
+    send = _make_sender(websocket, codec)
     streaming_service = get_streaming_service()
+    # image_id -> file_path for this connection; only the first message that
+    # references an image needs a pool checkout
+    image_paths: dict[str, Optional[str]] = {}
     
     try:
         while True:
@@ -133,43 +233,36 @@ async def stream_ai_response(
                 # Load image if provided
                 image = None
                 if image_id:
-                    async with async_session_maker() as db:
-                        result = await db.execute(
-                            select(Image).where(Image.id == uuid.UUID(image_id))
-                        )
-                        img_record = result.scalar_one_or_none()
-                        if img_record and Path(img_record.file_path).exists():
-                            image = load_image_from_file(img_record.file_path)
+                    if image_id not in image_paths:
+                        async with async_session_maker() as db:
+                            image_paths[image_id] = await db.scalar(
+                                select(Image.file_path).where(Image.id == uuid.UUID(image_id))
+                            )
+                    file_path = image_paths[image_id]
+                    if file_path:
+                        # PIL decode runs on the shared executor, not the loop
+                        loop = asyncio.get_running_loop()
+                        try:
+                            image = await loop.run_in_executor(
+                                get_executor(), load_image_from_file, file_path
+                            )
+                        except FileNotFoundError:
+                            logger.warning(f"Image file not found on disk: {file_path}")
                 
                 # Stream response
-                tokens_used = 0
-                async for chunk in streaming_service.stream_chat_response(
+                async for item in streaming_service.stream_chat_response(
                     message=content,
                     image=image,
                 ):
-                    if chunk.startswith("\n[STREAM_END:"):
-                        # Extract tokens from metadata
-                        try:
-                            tokens_used = int(chunk.split("=")[1].rstrip("]"))
-                        except:
-                            pass
-                        await websocket.send_json({
-                            "type": "complete",
-                            "tokens_used": tokens_used,
-                        })
-                    elif chunk.startswith("\n[STREAM_ERROR:"):
-                        await websocket.send_json({
-                            "type": "error",
-                            "message": chunk[15:-1],
-                        })
+                    if isinstance(item, TokenChunk):
+                        await send("token", item.text)
+                    elif isinstance(item, StreamEnd):
+                        await send("complete", item.tokens)
                     else:
-                        await websocket.send_json({
-                            "type": "token",
-                            "content": chunk,
-                        })
+                        await send("error", item.message)
             
             elif data.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+                await send("pong")
                 
     except WebSocketDisconnect:
         logger.info(f"Streaming client disconnected: {session_id}")
@@ -1,19 +1,24 @@
 """
 MedXrayChat Backend - Study Endpoints
 """
+import os
 import uuid
+import asyncio
 import shutil
 import tempfile
-import io
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException, status, UploadFile, File, Query
-from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy import select, func
+from types import MappingProxyType
+from typing import List, Mapping, Optional
+from fastapi import APIRouter, HTTPException, status, UploadFile, File, Query, Request
+from fastapi.responses import FileResponse, Response
+from cachetools import LRUCache
+from sqlalchemy import select, func, exists, update
 from PIL import Image as PILImage
 from loguru import logger
 
 from core.config import settings
+from core.image_utils import WINDOWING_VERSION, convert_dicom_to_png, get_cached_png_path
 from models import Study, Image
 from schemas import (
     StudyCreate,
@@ -23,107 +28,61 @@ from schemas import (
     ImageUploadResponse,
 )
 from api.deps import CurrentUser, DbSession
+from services.executor import get_process_pool
 
 
-def get_cached_png_path(dicom_path: Path) -> Path:
-    """Get the path for cached PNG version of a DICOM file."""
-    return dicom_path.with_suffix('.png')
+# Freshly converted PNG bytes keyed by (cache path, mtime_ns), bounded by total
+# size; a rewritten cache file gets a new mtime and so a fresh entry. Files that
+# are only on disk are streamed with FileResponse instead.
+_png_memory_cache: LRUCache = LRUCache(
+    maxsize=settings.PNG_MEMORY_CACHE_MB * 1024 * 1024, getsizeof=len
+)
 
 
-def convert_dicom_to_png(file_path: Path, use_cache: bool = True) -> tuple[bytes, Path | None]:
-    """Convert DICOM file to PNG bytes.
+def _png_memory_put(cached_path: Path, png_bytes: bytes) -> None:
+    """Remember PNG bytes for a cache file (skipped if it is not on disk or too large)."""
+    try:
+        _png_memory_cache[(str(cached_path), cached_path.stat().st_mtime_ns)] = png_bytes
+    except (FileNotFoundError, ValueError):
+        pass
 
-    Returns:
-        Tuple of (png_bytes, cached_file_path or None)
-    """
-    # Check for cached version first
-    cached_path = get_cached_png_path(file_path)
-    if use_cache and cached_path.exists():
-        logger.info(f"Using cached PNG: {cached_path}")
-        return cached_path.read_bytes(), cached_path
 
-    try:
-        import pydicom
-        import numpy as np
-
-        logger.info(f"Converting DICOM to PNG: {file_path}")
-
-        # Read DICOM file
-        ds = pydicom.dcmread(str(file_path))
-
-        # Get pixel array
-        pixel_array = ds.pixel_array
-
-        # Apply window/level if present
-        if hasattr(ds, 'WindowCenter') and hasattr(ds, 'WindowWidth'):
-            window_center = float(ds.WindowCenter) if not isinstance(ds.WindowCenter, pydicom.multival.MultiValue) else float(ds.WindowCenter[0])
-            window_width = float(ds.WindowWidth) if not isinstance(ds.WindowWidth, pydicom.multival.MultiValue) else float(ds.WindowWidth[0])
-
-            # Apply window/level
-            min_val = window_center - window_width / 2
-            max_val = window_center + window_width / 2
-            pixel_array = np.clip(pixel_array, min_val, max_val)
-            pixel_array = ((pixel_array - min_val) / (max_val - min_val) * 255).astype(np.uint8)
-        else:
-            # Normalize to 0-255
-            pixel_array = pixel_array.astype(float)
-            pixel_array = (pixel_array - pixel_array.min()) / (pixel_array.max() - pixel_array.min() + 1e-8) * 255
-            pixel_array = pixel_array.astype(np.uint8)
-
-        # Handle PhotometricInterpretation
-        if hasattr(ds, 'PhotometricInterpretation') and ds.PhotometricInterpretation == 'MONOCHROME1':
-            pixel_array = 255 - pixel_array
-
-        # Create PIL Image
-        img = PILImage.fromarray(pixel_array)
-
-        # Convert to RGB if needed (for consistency)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        # Save to bytes
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='PNG')
-        png_data = img_bytes.getvalue()
-
-        # Cache to disk for faster subsequent access
-        if use_cache:
-            try:
-                cached_path.write_bytes(png_data)
-                logger.info(f"Cached PNG to: {cached_path}")
-            except Exception as e:
-                logger.warning(f"Failed to cache PNG: {e}")
+_UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
 
-        return png_data, cached_path if use_cache else None
-    except Exception as e:
-        logger.error(f"Failed to convert DICOM to PNG: {e}")
-        raise
 
+# File magic bytes for validation: ext -> (offset, magic)
+FILE_MAGIC_BYTES: Mapping[str, tuple[int, bytes]] = MappingProxyType({
+    "png": (0, b"\x89PNG\r\n\x1a\n"),
+    "jpg": (0, b"\xff\xd8\xff"),
+    "jpeg": (0, b"\xff\xd8\xff"),
+    "dcm": (128, b"DICM"),  # DICOM files have DICM at offset 128
+    "dicom": (128, b"DICM"),
+})
 
-# File magic bytes for validation
-FILE_MAGIC_BYTES = {
-    "png": [b"\x89PNG\r\n\x1a\n"],
-    "jpg": [b"\xff\xd8\xff"],
-    "jpeg": [b"\xff\xd8\xff"],
-    "dcm": [b"DICM"],  # DICOM files have DICM at offset 128
-    "dicom": [b"DICM"],
-}
+# Image bytes only change with the file's mtime (part of the ETag), so
+# clients may reuse them for an hour and revalidate cheaply after
+_IMAGE_CACHE_CONTROL = "private, max-age=3600"
+
+# Media types for serving original files, by lowercase suffix
+_MEDIA_TYPES: Mapping[str, str] = MappingProxyType({
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".dcm": "application/dicom",
+    ".dicom": "application/dicom",
+})
 
 
 def _validate_file_magic(file_path: Path, expected_ext: str) -> bool:
     """Validate file content matches expected type using magic bytes."""
+    entry = FILE_MAGIC_BYTES.get(expected_ext)
+    if entry is None:
+        return False
+    offset, magic = entry
     try:
         with open(file_path, "rb") as f:
-            # For DICOM, magic bytes are at offset 128
-            if expected_ext in ("dcm", "dicom"):
-                f.seek(128)
-                header = f.read(4)
-                return header == b"DICM"
-
-            # For other formats, check beginning of file
-            header = f.read(8)
-            expected_magics = FILE_MAGIC_BYTES.get(expected_ext, [])
-            return any(header.startswith(magic) for magic in expected_magics)
+            f.seek(offset)
+            return f.read(len(magic)) == magic
     except Exception as e:
         logger.warning(f"Failed to validate file magic: {e}")
         return False
@@ -132,7 +91,14 @@ def _validate_file_magic(file_path: Path, expected_ext: str) -> bool:
 router = APIRouter(prefix="/studies", tags=["Studies"])
 
 
-def get_study_response(study: Study, image_count: int = 0) -> StudyResponse:
+async def _study_owned_by(db, study_id: uuid.UUID, user_id: uuid.UUID) -> bool:
+    """Check study ownership with a bare EXISTS instead of loading the row."""
+    return await db.scalar(
+        select(exists().where(Study.id == study_id, Study.user_id == user_id))
+    )
+
+
+def get_study_response(study: Study) -> StudyResponse:
     """Convert Study model to response with image count."""
     return StudyResponse(
         id=study.id,
@@ -143,7 +109,7 @@ def get_study_response(study: Study, image_count: int = 0) -> StudyResponse:
         study_date=study.study_date,
         modality=study.modality,
         description=study.description,
-        image_count=image_count,
+        image_count=study.image_count,
         created_at=study.created_at,
     )
 
@@ -154,31 +120,35 @@ async def list_studies(
     db: DbSession,
     page: int = 1,
     size: int = 20,
+    fast_pagination: bool = False,
 ) -> StudyListResponse:
-    """List all studies for current user."""
+    """List all studies for current user.
+
+    With ``fast_pagination`` the total-count query is skipped and ``total``
+    is -1.
+    """
     # Count total
-    count_query = select(func.count()).select_from(Study).where(
-        Study.user_id == current_user.id
-    )
-    total_result = await db.execute(count_query)
-    total = total_result.scalar()
+    total = -1
+    if not fast_pagination:
+        count_query = select(func.count()).select_from(Study).where(
+            Study.user_id == current_user.id
+        )
+        total_result = await db.execute(count_query)
+        total = total_result.scalar()
     
-    # Get paginated studies with image counts
+    # Get paginated studies (image_count is a column, no aggregation needed)
     offset = (page - 1) * size
     query = (
-        select(Study, func.count(Image.id).label("image_count"))
-        .outerjoin(Image)
+        select(Study)
         .where(Study.user_id == current_user.id)
-        .group_by(Study.id)
         .order_by(Study.created_at.desc())
         .offset(offset)
         .limit(size)
     )
     
     result = await db.execute(query)
-    rows = result.all()
     
-    items = [get_study_response(study, img_count) for study, img_count in rows]
+    items = [get_study_response(study) for study in result.scalars()]
     
     return StudyListResponse(
         items=items,
@@ -204,7 +174,7 @@ async def create_study(
     await db.commit()
     await db.refresh(study)
     
-    return get_study_response(study, 0)
+    return get_study_response(study)
 
 
 @router.get("/{study_id}", response_model=StudyResponse)
@@ -214,24 +184,18 @@ async def get_study(
     db: DbSession,
 ) -> StudyResponse:
     """Get a specific study."""
-    query = (
-        select(Study, func.count(Image.id).label("image_count"))
-        .outerjoin(Image)
-        .where(Study.id == study_id, Study.user_id == current_user.id)
-        .group_by(Study.id)
+    result = await db.execute(
+        select(Study).where(Study.id == study_id, Study.user_id == current_user.id)
     )
+    study = result.scalar_one_or_none()
     
-    result = await db.execute(query)
-    row = result.first()
-    
-    if not row:
+    if not study:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Study not found"
         )
     
-    study, image_count = row
-    return get_study_response(study, image_count)
+    return get_study_response(study)
 
 
 @router.delete("/{study_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -269,10 +233,7 @@ async def list_study_images(
 ) -> List[Image]:
     """List all images in a study."""
     # Verify study belongs to user
-    study_result = await db.execute(
-        select(Study).where(Study.id == study_id, Study.user_id == current_user.id)
-    )
-    if not study_result.scalar_one_or_none():
+    if not await _study_owned_by(db, study_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Study not found"
@@ -286,6 +247,7 @@ async def list_study_images(
 
 @router.get("/images/{image_id}/file", response_model=None)
 async def get_image_file(
+    request: Request,
     image_id: uuid.UUID,
     current_user: CurrentUser,
     db: DbSession,
@@ -295,62 +257,95 @@ async def get_image_file(
 
     For DICOM files, pass format=png to convert to PNG for browser display.
     """
-    # Get image and verify ownership through study
+    # Fetch only the two columns needed, verifying ownership through study
     result = await db.execute(
-        select(Image)
+        select(Image.file_path, Image.original_filename)
         .join(Study, Image.study_id == Study.id)
         .where(Image.id == image_id, Study.user_id == current_user.id)
     )
-    image = result.scalar_one_or_none()
+    row = result.first()
 
-    if not image:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Image not found"
         )
+    stored_path, original_filename = row
 
     # Check file exists - handle both absolute and relative paths
-    file_path = Path(image.file_path)
+    file_path = Path(stored_path)
     if not file_path.is_absolute():
         # If relative, resolve from current working directory
-        file_path = Path.cwd() / image.file_path
+        file_path = Path.cwd() / stored_path
 
-    logger.info(f"Serving image file: {file_path} (exists: {file_path.exists()})")
-
-    if not file_path.exists():
+    try:
+        mtime_ns = file_path.stat().st_mtime_ns
+    except FileNotFoundError:
         logger.error(f"Image file not found: {file_path}")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Image file not found on disk: {image.file_path}"
+            detail=f"Image file not found on disk: {stored_path}"
         )
 
+    logger.info(f"Serving image file: {file_path}")
+
     # Determine media type based on extension
     ext = file_path.suffix.lower()
 
     # Check if this is a DICOM file and needs conversion
     is_dicom = ext in ('.dcm', '.dicom')
+    convert = is_dicom and (format == 'png' or format is None)
+
+    # Same image + same file version + same representation => same bytes
+    etag = f'"{image_id.hex}-{mtime_ns}-{f"png{WINDOWING_VERSION}" if convert else "raw"}"'
+    cache_headers = {"ETag": etag, "Cache-Control": _IMAGE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
 
     # Auto-convert DICOM to PNG for browser compatibility (or if explicitly requested)
-    if is_dicom and (format == 'png' or format is None):
+    if convert:
         try:
-            png_bytes, cached_path = convert_dicom_to_png(file_path)
-
-            # If we have a cached file, serve it directly (faster)
-            if cached_path and cached_path.exists():
-                return FileResponse(
-                    path=str(cached_path),
-                    media_type="image/png",
-                    filename=f"{image_id}.png",
+            cached_path = get_cached_png_path(file_path, version=f"{mtime_ns:x}")
+            png_headers = {
+                "Content-Disposition": f'inline; filename="{image_id}.png"',
+                **cache_headers,
+            }
+            try:
+                cached_stat = cached_path.stat()
+            except FileNotFoundError:
+                cached_stat = None
+
+            if cached_stat is not None:
+                png_bytes = _png_memory_cache.get((str(cached_path), cached_stat.st_mtime_ns))
+                if png_bytes is None:
+                    # Disk cache hit: let FileResponse stream it (sendfile)
+                    # instead of reading it on the event loop
+                    return FileResponse(
+                        path=cached_path,
+                        media_type="image/png",
+                        headers=png_headers,
+                        stat_result=cached_stat,
+                    )
+            else:
+                # Decode + windowing + PNG encode is CPU-bound; run it in a
+                # worker process so it neither blocks the loop nor holds the GIL
+                loop = asyncio.get_running_loop()
+                png_bytes, converted_path = await loop.run_in_executor(
+                    get_process_pool(),
+                    partial(
+                        convert_dicom_to_png,
+                        file_path,
+                        compress_level=settings.PNG_COMPRESS_LEVEL,
+                    ),
                 )
+                if png_bytes is None:
+                    # Another request published the cache file meanwhile
+                    return FileResponse(
+                        path=converted_path, media_type="image/png", headers=png_headers
+                    )
+                _png_memory_put(cached_path, png_bytes)
 
-            # Otherwise stream the bytes
-            return StreamingResponse(
-                io.BytesIO(png_bytes),
-                media_type="image/png",
-                headers={
-                    "Content-Disposition": f'inline; filename="{image_id}.png"'
-                }
-            )
+            return Response(content=png_bytes, media_type="image/png", headers=png_headers)
         except Exception as e:
             logger.error(f"DICOM conversion failed: {e}")
             raise HTTPException(
@@ -359,21 +354,15 @@ async def get_image_file(
             )
 
     # Return original file for non-DICOM or if raw DICOM is requested
-    media_types = {
-        ".png": "image/png",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".dcm": "application/dicom",
-        ".dicom": "application/dicom",
-    }
-    media_type = media_types.get(ext, "application/octet-stream")
+    media_type = _MEDIA_TYPES.get(ext, "application/octet-stream")
 
     logger.info(f"Returning file: {file_path}, media_type: {media_type}")
 
     return FileResponse(
         path=str(file_path.resolve()),
         media_type=media_type,
-        filename=image.original_filename or f"{image_id}{ext}",
+        filename=original_filename or f"{image_id}{ext}",
+        headers=cache_headers,
     )
 
 @router.post("/{study_id}/images", response_model=ImageUploadResponse)
@@ -388,10 +377,7 @@ async def upload_image(
     Uses temp file for atomic upload with proper validation.
     """
     # Verify study belongs to user
-    study_result = await db.execute(
-        select(Study).where(Study.id == study_id, Study.user_id == current_user.id)
-    )
-    if not study_result.scalar_one_or_none():
+    if not await _study_owned_by(db, study_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Study not found"
@@ -411,13 +397,23 @@ async def upload_image(
     max_size = settings.MAX_UPLOAD_SIZE_MB * 1024 * 1024
 
     try:
-        # Write to temp file with streaming size check
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as temp_file:
+        # Create study directory using absolute path
+        upload_base = Path(settings.UPLOAD_DIR)
+        if not upload_base.is_absolute():
+            upload_base = Path.cwd() / upload_base
+        study_dir = upload_base / str(study_id)
+        study_dir.mkdir(parents=True, exist_ok=True)
+
+        # Write to temp file with streaming size check. The temp file lives in
+        # the study directory so the final move is a same-filesystem rename.
+        with tempfile.NamedTemporaryFile(
+            delete=False, dir=study_dir, prefix=".upload-", suffix=f".{ext}"
+        ) as temp_file:
             temp_path = Path(temp_file.name)
             total_size = 0
 
-            # Stream chunks to avoid loading entire file into memory
-            while chunk := await file.read(8192):
+            # Stream 1 MiB chunks to avoid loading entire file into memory
+            while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
                 total_size += len(chunk)
                 if total_size > max_size:
                     raise HTTPException(
@@ -435,16 +431,9 @@ async def upload_image(
                 detail="File content does not match declared type"
             )
 
-        # Create study directory using absolute path
-        upload_base = Path(settings.UPLOAD_DIR)
-        if not upload_base.is_absolute():
-            upload_base = Path.cwd() / upload_base
-        study_dir = upload_base / str(study_id)
-        study_dir.mkdir(parents=True, exist_ok=True)
-
-        # Move to final location (atomic on same filesystem)
+        # Move to final location (atomic rename within the study directory)
         final_path = study_dir / f"{image_id}.{ext}"
-        shutil.move(str(temp_path), str(final_path))
+        os.replace(temp_path, final_path)
         temp_path = None  # File has been moved
 
         logger.info(f"Image saved to: {final_path}")
@@ -469,6 +458,12 @@ async def upload_image(
         )
 
         db.add(image)
+        # Atomic in-database increment, safe against concurrent uploads
+        await db.execute(
+            update(Study)
+            .where(Study.id == study_id)
+            .values(image_count=Study.image_count + 1)
+        )
         await db.commit()
 
         return ImageUploadResponse(
@@ -7,7 +7,7 @@ when external services or AI models are experiencing issues.
 import time
 import threading
 from enum import Enum
-from typing import TypeVar, Callable, Optional
+from typing import TypeVar, Callable, Optional, Tuple
 from dataclasses import dataclass
 from loguru import logger
 
@@ -52,6 +52,11 @@ class CircuitBreaker:
             return breaker.call(yolo_model.predict, image)
     """
 
+    # State lives in one immutable tuple, (state, failure_count,
+    # success_count, last_failure_time), swapped whole under the lock so
+    # readers can take a consistent snapshot without it
+    __slots__ = ("name", "config", "_snap", "_lock")
+
     def __init__(self, name: str, config: Optional[CircuitBreakerConfig] = None):
         """Initialize circuit breaker.
 
@@ -61,28 +66,34 @@ class CircuitBreaker:
         """
         self.name = name
         self.config = config or CircuitBreakerConfig()
-        self._state = CircuitState.CLOSED
-        self._failure_count = 0
-        self._success_count = 0
-        self._last_failure_time: Optional[float] = None
+        self._snap: Tuple[CircuitState, int, int, Optional[float]] = (
+            CircuitState.CLOSED, 0, 0, None
+        )
         self._lock = threading.Lock()
 
     @property
     def state(self) -> CircuitState:
         """Get current circuit state, checking for recovery timeout."""
+        # Only an OPEN circuit can transition here, so CLOSED/HALF_OPEN
+        # return straight from the snapshot without the lock
+        state = self._snap[0]
+        if state is not CircuitState.OPEN:
+            return state
+
         with self._lock:
-            if self._state == CircuitState.OPEN:
+            state, failures, _, last_failure = self._snap
+            if state is CircuitState.OPEN:
                 # Check if recovery timeout has passed
-                if self._last_failure_time is not None:
-                    elapsed = time.time() - self._last_failure_time
+                if last_failure is not None:
+                    elapsed = time.time() - last_failure
                     if elapsed >= self.config.recovery_timeout:
-                        self._state = CircuitState.HALF_OPEN
-                        self._success_count = 0
+                        state = CircuitState.HALF_OPEN
+                        self._snap = (state, failures, 0, last_failure)
                         logger.info(
                             f"Circuit breaker '{self.name}' entering HALF_OPEN state "
                             f"after {elapsed:.1f}s"
                         )
-            return self._state
+            return state
 
     @property
     def is_closed(self) -> bool:
@@ -125,22 +136,29 @@ class CircuitBreaker:
 
     def _on_success(self) -> None:
         """Handle successful call."""
+        # Common case: CLOSED with no failures recorded, nothing to reset
+        state, failures, _, _ = self._snap
+        if state is CircuitState.CLOSED and failures == 0:
+            return
+
         with self._lock:
-            if self._state == CircuitState.HALF_OPEN:
-                self._success_count += 1
+            state, failures, successes, last_failure = self._snap
+            if state == CircuitState.HALF_OPEN:
+                successes += 1
                 logger.debug(
                     f"Circuit breaker '{self.name}' success in HALF_OPEN: "
-                    f"{self._success_count}/{self.config.success_threshold}"
+                    f"{successes}/{self.config.success_threshold}"
                 )
-                if self._success_count >= self.config.success_threshold:
-                    self._state = CircuitState.CLOSED
-                    self._failure_count = 0
+                if successes >= self.config.success_threshold:
+                    state = CircuitState.CLOSED
+                    failures = 0
                     logger.info(
                         f"Circuit breaker '{self.name}' CLOSED after successful recovery"
                     )
-            elif self._state == CircuitState.CLOSED:
+            elif state == CircuitState.CLOSED:
                 # Reset failure count on success
-                self._failure_count = 0
+                failures = 0
+            self._snap = (state, failures, successes, last_failure)
 
     def _on_failure(self, exception: Exception) -> None:
         """Handle failed call.
@@ -149,36 +167,35 @@ class CircuitBreaker:
             exception: The exception that occurred
         """
         with self._lock:
-            self._failure_count += 1
-            self._last_failure_time = time.time()
+            state, failures, successes, _ = self._snap
+            failures += 1
+            last_failure = time.time()
 
-            if self._state == CircuitState.HALF_OPEN:
+            if state == CircuitState.HALF_OPEN:
                 # Any failure in half-open reopens the circuit
-                self._state = CircuitState.OPEN
+                state = CircuitState.OPEN
                 logger.warning(
                     f"Circuit breaker '{self.name}' re-opened after failure in HALF_OPEN: "
                     f"{type(exception).__name__}: {exception}"
                 )
-            elif self._failure_count >= self.config.failure_threshold:
-                self._state = CircuitState.OPEN
+            elif failures >= self.config.failure_threshold:
+                state = CircuitState.OPEN
                 logger.warning(
-                    f"Circuit breaker '{self.name}' OPENED after {self._failure_count} "
+                    f"Circuit breaker '{self.name}' OPENED after {failures} "
                     f"consecutive failures. Last error: {type(exception).__name__}: {exception}"
                 )
             else:
                 logger.debug(
                     f"Circuit breaker '{self.name}' failure "
-                    f"{self._failure_count}/{self.config.failure_threshold}: "
+                    f"{failures}/{self.config.failure_threshold}: "
                     f"{type(exception).__name__}"
                 )
+            self._snap = (state, failures, successes, last_failure)
 
     def reset(self) -> None:
         """Manually reset circuit breaker to closed state."""
         with self._lock:
-            self._state = CircuitState.CLOSED
-            self._failure_count = 0
-            self._success_count = 0
-            self._last_failure_time = None
+            self._snap = (CircuitState.CLOSED, 0, 0, None)
             logger.info(f"Circuit breaker '{self.name}' manually reset to CLOSED")
 
     def get_status(self) -> dict:
@@ -187,19 +204,19 @@ class CircuitBreaker:
         Returns:
             Dict with state, failure count, and timing info
         """
-        with self._lock:
-            return {
-                "name": self.name,
-                "state": self._state.value,
-                "failure_count": self._failure_count,
-                "success_count": self._success_count,
-                "last_failure": self._last_failure_time,
-                "config": {
-                    "failure_threshold": self.config.failure_threshold,
-                    "recovery_timeout": self.config.recovery_timeout,
-                    "success_threshold": self.config.success_threshold,
-                }
+        state, failures, successes, last_failure = self._snap
+        return {
+            "name": self.name,
+            "state": state.value,
+            "failure_count": failures,
+            "success_count": successes,
+            "last_failure": last_failure,
+            "config": {
+                "failure_threshold": self.config.failure_threshold,
+                "recovery_timeout": self.config.recovery_timeout,
+                "success_threshold": self.config.success_threshold,
             }
+        }
 
 
 # Global circuit breakers for AI services
@@ -35,6 +35,7 @@ class Settings(BaseSettings):
     SECRET_KEY: str = _DEFAULT_SECRET_KEY
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440  # 24 hours
+    BCRYPT_ROUNDS: int = 12  # Cost factor for new hashes; each +1 doubles hashing time
 
     @field_validator("SECRET_KEY")
     @classmethod
@@ -64,6 +65,9 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "medxraychat"
     POSTGRES_HOST: str = "localhost"
     POSTGRES_PORT: int = 5432
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 30
+    DB_POOL_RECYCLE: int = 1800  # seconds
     
     @property
     def DATABASE_URL(self) -> str:
@@ -94,15 +98,20 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE_MB: int = 100
     ALLOWED_EXTENSIONS: set = {"png", "jpg", "jpeg", "dicom", "dcm"}
+    HEATMAP_CACHE_DIR: str = "uploads/.heatmaps"
+    PNG_COMPRESS_LEVEL: int = 1  # zlib level for DICOM->PNG conversion (0-9)
+    PNG_MEMORY_CACHE_MB: int = 256  # in-process cache of converted DICOM PNGs
     
     # CORS
     CORS_ORIGINS: list[str] = ["http://localhost:3000", "http://localhost:8080", "http://127.0.0.1:3000"]
 
     # AI Processing
     AI_THREAD_WORKERS: int = 4
+    DICOM_PROCESS_WORKERS: int = 2  # processes for DICOM->PNG conversion
     AI_DEVICE: str = "cuda"  # 'auto', 'cuda', 'cpu', 'cuda:0', etc.
     PRELOAD_AI_MODELS: bool = True
     QWEN_MAX_CONTEXT_TOKENS: int = 4096
+    CHAT_HISTORY_WINDOW: int = 50  # most recent messages sent as chat context
     
     # Mock mode for testing without Qwen model
     MOCK_QWEN_SERVICE: bool = True  # Set to False when you have the real model
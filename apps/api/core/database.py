@@ -1,20 +1,34 @@
 """
 MedXrayChat Backend - Database Configuration
 """
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator
+import orjson
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
 from core.config import settings
 
 
+def _orjson_serializer(obj: Any) -> str:
+    """Serialize JSON columns with orjson (asyncpg expects text, not bytes)."""
+    return orjson.dumps(obj).decode()
+
+
 # Create async engine
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=settings.DEBUG,
     pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=10,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    # Reuse the most recently returned connection so a small hot set stays
+    # warm and idle extras can be recycled
+    pool_use_lifo=True,
+    # JSON columns (detections, annotations) go through orjson both ways
+    json_serializer=_orjson_serializer,
+    json_deserializer=orjson.loads,
 )
 
 # Create session factory
@@ -51,6 +65,12 @@ async def init_db() -> None:
         await conn.run_sync(Base.metadata.create_all)
 
 
+async def warm_db_pool() -> None:
+    """Open a pooled connection at startup so the first request skips the connect handshake."""
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
 async def close_db() -> None:
     """Close database connections."""
     await engine.dispose()
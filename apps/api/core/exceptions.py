@@ -4,7 +4,7 @@ MedXrayChat Backend - Custom Exceptions and Error Handlers
 Provides structured exception hierarchy and FastAPI exception handlers
 for consistent error responses across the application.
 """
-import uuid
+import secrets
 from typing import Optional, Any
 from fastapi import Request
 from fastapi.responses import JSONResponse
@@ -102,6 +102,14 @@ class ValidationError(MedXrayChatError):
         )
 
 
+# HTTP status per error class (exact type); anything else is a 500
+_STATUS_CODES = {
+    CircuitBreakerOpenError: 503,  # Service Unavailable
+    ValidationError: 400,  # Bad Request
+    ModelNotLoadedError: 503,  # Service Unavailable
+}
+
+
 # Exception Handlers for FastAPI
 
 async def medxraychat_exception_handler(
@@ -117,16 +125,8 @@ async def medxraychat_exception_handler(
     Returns:
         JSONResponse with error details
     """
-    error_id = str(uuid.uuid4())[:8]
-
-    # Determine status code based on error type
-    status_code = 500
-    if isinstance(exc, CircuitBreakerOpenError):
-        status_code = 503  # Service Unavailable
-    elif isinstance(exc, ValidationError):
-        status_code = 400  # Bad Request
-    elif isinstance(exc, ModelNotLoadedError):
-        status_code = 503  # Service Unavailable
+    error_id = secrets.token_hex(4)
+    status_code = _STATUS_CODES.get(type(exc), 500)
 
     logger.error(
         f"Application error [{error_id}]: {exc.code} - {exc.message}",
@@ -164,7 +164,7 @@ async def generic_exception_handler(
     Returns:
         JSONResponse with generic error message
     """
-    error_id = str(uuid.uuid4())[:8]
+    error_id = secrets.token_hex(4)
 
     logger.error(
         f"Unhandled exception [{error_id}]: {type(exc).__name__}: {str(exc)}",
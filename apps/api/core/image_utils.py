@@ -2,12 +2,213 @@
 MedXrayChat Backend - Image Utilities
 Helper functions for loading and processing medical images.
 """
+import io
+import os
+import threading
 from pathlib import Path
+from typing import Optional
 from PIL import Image as PILImage
 import numpy as np
+import pydicom
+from pydicom.pixels import apply_modality_lut, apply_voi_lut
 from loguru import logger
 
 
+# Fallback windowing for DICOMs without a VOI window in the header
+_CLIP_PERCENTILES = (4, 96)
+
+# Bumped whenever the windowing changes, so caches of older output are not reused
+WINDOWING_VERSION = 2
+
+
+def get_cached_grayscale_path(dicom_path: Path, version: Optional[str] = None) -> Path:
+    """Get the path for the cached uint8 grayscale array of a DICOM file.
+
+    Versioned by the DICOM's mtime_ns (hex), like the PNG cache, so a
+    replaced DICOM never serves a stale array.
+    """
+    if version is None:
+        version = f"{dicom_path.stat().st_mtime_ns:x}"
+    return dicom_path.with_suffix(f'.{version}.w{WINDOWING_VERSION}.u8.npy')
+
+
+def get_cached_png_path(dicom_path: Path, version: Optional[str] = None) -> Path:
+    """Get the path for cached PNG version of a DICOM file.
+
+    The name carries a version (by default the DICOM's mtime_ns in hex) and
+    the windowing version, so neither a replaced DICOM nor a windowing change
+    serves a stale PNG.
+    """
+    if version is None:
+        version = f"{dicom_path.stat().st_mtime_ns:x}"
+    return dicom_path.with_suffix(f'.{version}.w{WINDOWING_VERSION}.png')
+
+
+def _window_to_uint8(pixel_array, min_val: float, max_val: float, invert: bool):
+    """Map pixel values in [min_val, max_val] onto 0-255 (optionally inverted).
+
+    Integer data up to 16 bits goes through a lookup table covering the whole
+    dtype range, so the image is read once as-is and written once as uint8
+    instead of being promoted to float.
+    """
+    scale = 255 / max(max_val - min_val, 1e-8)
+    dtype = pixel_array.dtype
+    if dtype.kind in "ui" and dtype.itemsize <= 2:
+        bits = dtype.itemsize * 8
+        if dtype.kind == "u":
+            values = np.arange(1 << bits)
+            index = pixel_array
+        else:
+            # Signed: flipping the sign bit of the unsigned view adds 2**(bits-1)
+            values = np.arange(-(1 << (bits - 1)), 1 << (bits - 1))
+            index = pixel_array.view(f"u{dtype.itemsize}") ^ (1 << (bits - 1))
+        lut = np.clip((values - min_val) * scale, 0, 255).astype(np.uint8)
+        if invert:
+            lut = 255 - lut
+        return lut[index]
+
+    # Float or wide data: one float32 working copy, scaled and clipped in
+    # place, then a single cast instead of a fresh temporary per operation
+    work = pixel_array.astype(np.float32)
+    np.subtract(work, min_val, out=work)
+    np.multiply(work, scale, out=work)
+    np.clip(work, 0, 255, out=work)
+    scaled = work.astype(np.uint8)
+    if invert:
+        np.subtract(255, scaled, out=scaled)
+    return scaled
+
+
+def dicom_to_grayscale(ds: pydicom.Dataset) -> np.ndarray:
+    """Decode a DICOM dataset to a display-ready uint8 array."""
+    # Rescale slope/intercept (or Modality LUT), then VOI LUT / windowing.
+    # Without those attributes both return the stored array unchanged, so
+    # plain integer X-rays still take the uint8 lookup-table path.
+    pixel_array = apply_modality_lut(ds.pixel_array, ds)
+    invert = ds.get('PhotometricInterpretation') == 'MONOCHROME1'
+
+    if 'WindowWidth' in ds or 'VOILUTSequence' in ds:
+        # Header window: stretch the windowed range onto 0-255
+        pixel_array = apply_voi_lut(pixel_array, ds, index=0)
+        lo, hi = float(pixel_array.min()), float(pixel_array.max())
+    else:
+        # No window: clip to the 4th-96th percentiles so a few hot pixels
+        # can't darken the whole image. A strided sample is plenty for
+        # the estimate and avoids sorting a full 9 MP copy.
+        sample = pixel_array[::4, ::4] if pixel_array.ndim == 2 else pixel_array
+        lo, hi = (float(v) for v in np.percentile(sample, _CLIP_PERCENTILES))
+
+    return _window_to_uint8(pixel_array, lo, hi, invert)
+
+
+def load_xray_grayscale(file_path: str | Path, use_cache: bool = True) -> np.ndarray:
+    """
+    Load a DICOM file as a windowed uint8 array, through an on-disk .npy cache.
+
+    A cache hit is memory-mapped read-only instead of being decoded again;
+    a miss decodes the DICOM and writes the cache for the next caller.
+
+    Args:
+        file_path: Path to the DICOM file
+        use_cache: Read and write the .npy cache next to the DICOM
+
+    Returns:
+        2D (or 3D for color) uint8 array
+    """
+    path = Path(file_path)
+    cached_path = get_cached_grayscale_path(path) if use_cache else None
+
+    if cached_path is not None:
+        try:
+            return np.load(cached_path, mmap_mode='r')
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable grayscale cache {cached_path}: {e}")
+
+    pixel_array = np.ascontiguousarray(dicom_to_grayscale(pydicom.dcmread(str(path))))
+
+    # Write to a temp name and rename so concurrent readers never map a
+    # partially written array
+    if cached_path is not None:
+        tmp_path = cached_path.with_name(
+            f".{cached_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, pixel_array)
+            os.replace(tmp_path, cached_path)
+        except Exception as e:
+            logger.warning(f"Failed to cache grayscale array: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    return pixel_array
+
+
+def convert_dicom_to_png(
+    file_path: Path, use_cache: bool = True, compress_level: int = 1
+) -> tuple[bytes | None, Path | None]:
+    """Convert DICOM file to PNG bytes.
+
+    Runs in the DICOM worker processes, which import only this module; keep
+    its dependencies light (no settings, models or AI services).
+
+    Returns:
+        Tuple of (png_bytes, cached_file_path or None). On a cache hit the
+        bytes are None; callers serve the cached file directly.
+    """
+    # Check for cached version first
+    cached_path = get_cached_png_path(file_path)
+    if use_cache and cached_path.exists():
+        logger.info(f"Using cached PNG: {cached_path}")
+        return None, cached_path
+
+    try:
+        logger.info(f"Converting DICOM to PNG: {file_path}")
+
+        # Windowed uint8 pixels, shared with the AI loaders via the .npy cache
+        pixel_array = load_xray_grayscale(file_path, use_cache=use_cache)
+
+        # Create PIL Image; monochrome stays single-channel ('L') so the
+        # PNG is grayscale rather than three identical channels. A contiguous
+        # 2D uint8 array is wrapped in place rather than copied.
+        if pixel_array.ndim == 2:
+            height, width = pixel_array.shape
+            img = PILImage.frombuffer('L', (width, height), pixel_array, 'raw', 'L', 0, 1)
+        else:
+            img = PILImage.fromarray(pixel_array)
+
+        # Save to bytes. With no outstanding buffer exports, getvalue() hands
+        # back BytesIO's own buffer rather than copying it
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='PNG', compress_level=compress_level)
+        png_data = img_bytes.getvalue()
+
+        # Cache to disk for faster subsequent access. Write to a temp name and
+        # rename so concurrent readers never see a partially written PNG.
+        if use_cache:
+            tmp_path = cached_path.with_name(f".{cached_path.name}.{os.getpid()}.tmp")
+            try:
+                tmp_path.write_bytes(png_data)
+                os.replace(tmp_path, cached_path)
+                logger.info(f"Cached PNG to: {cached_path}")
+            except Exception as e:
+                logger.warning(f"Failed to cache PNG: {e}")
+                tmp_path.unlink(missing_ok=True)
+
+        return png_data, cached_path if use_cache else None
+    except Exception as e:
+        logger.error(f"Failed to convert DICOM to PNG: {e}")
+        raise
+
+
+def _is_dicom(path: Path) -> bool:
+    """Check for the 'DICM' magic after the 128-byte DICOM preamble."""
+    with open(path, 'rb') as f:
+        f.seek(128)
+        return f.read(4) == b'DICM'
+
+
 def load_image_from_file(file_path: str) -> PILImage.Image:
     """
     Load image from file, supporting both DICOM and regular image formats.
@@ -20,28 +221,17 @@ def load_image_from_file(file_path: str) -> PILImage.Image:
     """
     path = Path(file_path)
     
-    # Try to load as DICOM first if extension suggests it
-    if path.suffix.lower() in ['.dcm', '.dicom', '']:
-        try:
-            import pydicom
-            ds = pydicom.dcmread(file_path)
-            pixel_array = ds.pixel_array
-            
-            # Normalize to 8-bit
-            if pixel_array.dtype != np.uint8:
-                pixel_array = pixel_array.astype(np.float32)
-                pixel_array = (pixel_array - pixel_array.min()) / (pixel_array.max() - pixel_array.min() + 1e-8)
-                pixel_array = (pixel_array * 255).astype(np.uint8)
-            
-            # Convert to RGB
-            if len(pixel_array.shape) == 2:
-                image = PILImage.fromarray(pixel_array).convert("RGB")
-            else:
-                image = PILImage.fromarray(pixel_array).convert("RGB")
-            
-            return image
-        except Exception as e:
-            logger.warning(f"Failed to load as DICOM: {e}, trying as regular image")
+    # Dispatch on the DICM magic rather than attempting a full DICOM parse
+    if _is_dicom(path):
+        # Same windowed uint8 pixels the viewer's PNG is made from
+        pixel_array = load_xray_grayscale(path)
+        
+        # Convert to RGB; grayscale is replicated into three channels in
+        # one numpy pass rather than through PIL's mode conversion
+        if pixel_array.ndim == 2:
+            rgb = np.stack([pixel_array] * 3, axis=-1)
+            return PILImage.fromarray(rgb)  # HxWx3 uint8 -> RGB
+        return PILImage.fromarray(pixel_array).convert("RGB")
     
-    # Fall back to regular image loading
+    # Regular image formats
     return PILImage.open(file_path).convert("RGB")
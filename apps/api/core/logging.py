@@ -5,10 +5,11 @@ Provides structured logging setup with request correlation IDs,
 JSON formatting for production, and human-readable format for development.
 """
 import sys
-import uuid
-import json
+import secrets
 from contextvars import ContextVar
+from datetime import datetime, timezone
 from typing import Optional, Any
+import orjson
 from loguru import logger
 
 
@@ -38,7 +39,7 @@ def set_request_id(request_id: Optional[str] = None) -> str:
         The request ID that was set
     """
     if request_id is None:
-        request_id = str(uuid.uuid4())[:8]
+        request_id = secrets.token_hex(4)
     request_id_var.set(request_id)
     return request_id
 
@@ -63,17 +64,35 @@ def clear_log_context() -> None:
     log_context_var.set({})
 
 
+_json_dumps = orjson.dumps
+_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _format_timestamp(time: datetime) -> str:
+    """Render a record time as ISO-8601 UTC with milliseconds and a Z suffix.
+
+    Formatted here rather than left to orjson: loguru's datetime subclass is
+    not serialized natively and would fall through to ``default=str``.
+    """
+    utc = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return utc.isoformat(timespec="milliseconds") + "Z"
+
+
 def json_formatter(record: dict) -> str:
     """Format log record as JSON for production logging.
 
+    Loguru treats the returned string as a format template, so the JSON is
+    stashed in the record's extra and referenced by placeholder; braces in
+    the payload are never re-parsed.
+
     Args:
         record: Loguru record dict
 
     Returns:
-        JSON formatted string
+        Format template emitting the JSON line
     """
     log_entry = {
-        "timestamp": record["time"].strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        "timestamp": _format_timestamp(record["time"]),
         "level": record["level"].name,
         "message": record["message"],
         "module": record["module"],
@@ -107,7 +126,20 @@ def json_formatter(record: dict) -> str:
             "traceback": "".join(exc.traceback.format()) if exc.traceback else None,
         }
 
-    return json.dumps(log_entry, ensure_ascii=False, default=str) + "\n"
+    record["extra"]["_json"] = _json_dumps(log_entry, default=str, option=_JSON_OPTIONS).decode()
+    return "{extra[_json]}\n"
+
+
+# Constant template: loguru parses (and caches) it once instead of re-parsing
+# a fresh string per record, and braces or "<tags>" in messages stay literal
+_HUMAN_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+    "<level>{level: <8}</level> | "
+    "<cyan>[{extra[_request_id]}]</cyan> | "
+    "<cyan>{module}</cyan>:<cyan>{function}</cyan>:"
+    "<cyan>{line}</cyan> - "
+    "<level>{message}</level>{extra[_extra_str]}\n"
+)
 
 
 def human_formatter(record: dict) -> str:
@@ -117,49 +149,52 @@ def human_formatter(record: dict) -> str:
         record: Loguru record dict
 
     Returns:
-        Formatted string
+        Format template for the record
     """
-    request_id = request_id_var.get() or "-"
-
-    # Build extra context string
-    extra_parts = []
+    extra = record["extra"]
     extra_context = log_context_var.get()
-    if extra_context:
-        for key, value in extra_context.items():
-            extra_parts.append(f"{key}={value}")
-
-    if record["extra"]:
-        for key, value in record["extra"].items():
-            if not key.startswith("_"):
-                extra_parts.append(f"{key}={value}")
 
-    extra_str = " | " + " ".join(extra_parts) if extra_parts else ""
+    # Build extra context string; the common no-context case allocates nothing
+    extra_str = ""
+    if extra_context or extra:
+        parts = " ".join(
+            f"{key}={value}"
+            for items in (extra_context.items(), extra.items())
+            for key, value in items
+            if not key.startswith("_")
+        )
+        if parts:
+            extra_str = " | " + parts
 
-    return (
-        f"<green>{record['time']:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
-        f"<level>{record['level'].name: <8}</level> | "
-        f"<cyan>[{request_id}]</cyan> | "
-        f"<cyan>{record['module']}</cyan>:<cyan>{record['function']}</cyan>:"
-        f"<cyan>{record['line']}</cyan> - "
-        f"<level>{record['message']}</level>{extra_str}\n"
-    )
+    extra["_request_id"] = request_id_var.get() or "-"
+    extra["_extra_str"] = extra_str
+    return _HUMAN_FORMAT
 
 
 def setup_logging(
     json_output: bool = False,
     log_level: str = "INFO",
     log_file: Optional[str] = None,
+    debug: bool = False,
 ) -> None:
     """Configure application logging.
 
+    Sinks are enqueued: records are formatted in the calling thread (so the
+    request context vars are still visible) and written by loguru's
+    background worker, keeping stderr/file I/O off the event loop.
+
     Args:
         json_output: Use JSON format (for production/log aggregation)
         log_level: Minimum log level to output
         log_file: Optional file path for log output
+        debug: Keep loguru's extended tracebacks with variable values
     """
     # Remove default handler
     logger.remove()
 
+    # Extended tracebacks are costly to build (and may expose values)
+    sink_options = {"enqueue": True, "backtrace": debug, "diagnose": debug}
+
     if json_output:
         # JSON format for production
         logger.add(
@@ -167,6 +202,7 @@ def setup_logging(
             format=json_formatter,
             level=log_level,
             serialize=False,
+            **sink_options,
         )
     else:
         # Human-readable format for development
@@ -175,6 +211,7 @@ def setup_logging(
             format=human_formatter,
             level=log_level,
             colorize=True,
+            **sink_options,
         )
 
     # Add file handler if specified
@@ -186,6 +223,7 @@ def setup_logging(
             rotation="100 MB",
             retention="7 days",
             compression="gz",
+            **sink_options,
         )
 
     logger.info(
@@ -207,8 +245,9 @@ def log_with_context(
     """
     log_func = getattr(logger, level.lower(), logger.info)
 
-    # Merge extra context
-    merged_extra = {**log_context_var.get(), **extra}
+    # Merge extra context (extra is already a fresh dict; copy only if needed)
+    context = log_context_var.get()
+    merged_extra = {**context, **extra} if context else extra
     request_id = request_id_var.get()
     if request_id:
         merged_extra["request_id"] = request_id
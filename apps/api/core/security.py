@@ -21,15 +21,16 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against a hash."""
     # Truncate to 72 bytes (bcrypt limit) for consistency
     password_bytes = plain_password.encode('utf-8')[:72]
-    return bcrypt.checkpw(password_bytes, hashed_password.encode('utf-8'))
+    # bcrypt hashes are pure ASCII ($2b$<cost>$<salt+digest>)
+    return bcrypt.checkpw(password_bytes, hashed_password.encode('ascii'))
 
 
 def get_password_hash(password: str) -> str:
     """Hash a password."""
     # Truncate to 72 bytes (bcrypt limit)
     password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+    salt = bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password_bytes, salt).decode('ascii')
 
 
 def create_access_token(
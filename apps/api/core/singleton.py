@@ -9,6 +9,8 @@ from typing import TypeVar, Callable, Dict, Any
 
 T = TypeVar('T')
 
+_MISSING = object()
+
 
 class ThreadSafeSingleton:
     """Thread-safe singleton container with double-checked locking.
@@ -37,21 +39,23 @@ class ThreadSafeSingleton:
         Returns:
             The singleton instance
         """
-        # Fast path without lock (already created)
-        if key in cls._instances:
-            return cls._instances[key]
-
-        # Ensure lock exists for this key
-        with cls._global_lock:
-            if key not in cls._locks:
-                cls._locks[key] = threading.Lock()
-
-        # Double-checked locking for thread safety
-        with cls._locks[key]:
+        # Fast path without lock (already created): a single dict lookup
+        instance = cls._instances.get(key, _MISSING)
+        if instance is not _MISSING:
+            return instance
+
+        # Ensure lock exists for this key; setdefault is atomic, so racing
+        # threads all end up with the same lock without the global lock
+        lock = cls._locks.setdefault(key, threading.Lock())
+
+        # Double-checked locking for thread safety. Unlike functools.cache,
+        # this guarantees the (expensive, model-loading) factory runs once.
+        with lock:
             # Check again after acquiring lock
-            if key not in cls._instances:
-                cls._instances[key] = factory()
-            return cls._instances[key]
+            instance = cls._instances.get(key, _MISSING)
+            if instance is _MISSING:
+                instance = cls._instances[key] = factory()
+            return instance
 
     @classmethod
     def reset(cls, key: str = None) -> None:
@@ -5,15 +5,15 @@ Implements streaming patterns similar to OpenAI/Anthropic APIs:
 - Structured event types (message_start, content_delta, message_stop)
 - Heartbeat for proxy compatibility
 - Client disconnect detection
-- Async queue-based streaming
+- Events serialized at emit time and yielded directly
 """
 import asyncio
-import json
 import time
 import uuid
 from typing import AsyncGenerator, Optional, Any, Callable
 from dataclasses import dataclass, asdict
 from enum import Enum
+import orjson
 from loguru import logger
 
 
@@ -43,11 +43,16 @@ class StreamEvent:
             "type": self.type.value,
             **self.data
         }
-        return f"event: {self.type.value}\ndata: {json.dumps(event_data, ensure_ascii=False)}\n\n"
+        # orjson emits UTF-8 as-is, same as json.dumps(ensure_ascii=False)
+        return f"event: {self.type.value}\ndata: {orjson.dumps(event_data).decode()}\n\n"
 
 
 class StreamingSession:
-    """Manages a streaming session with proper lifecycle."""
+    """Manages a streaming session with proper lifecycle.
+
+    ``emit_*`` helpers return the serialized SSE frame so the caller can
+    yield it straight to the response without an intermediate queue.
+    """
 
     def __init__(
         self,
@@ -59,62 +64,46 @@ class StreamingSession:
         self.message_id = str(uuid.uuid4())
         self.heartbeat_interval = heartbeat_interval
         self.timeout = timeout
-        self.queue: asyncio.Queue[Optional[StreamEvent]] = asyncio.Queue()
         self.is_active = True
         self.start_time = time.time()
         self.total_tokens = 0
-        self._heartbeat_task: Optional[asyncio.Task] = None
 
     async def start(self) -> None:
         """Start the streaming session."""
-        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        self.is_active = True
         logger.debug(f"Streaming session {self.session_id} started")
 
     async def stop(self) -> None:
         """Stop the streaming session."""
         self.is_active = False
-        if self._heartbeat_task:
-            self._heartbeat_task.cancel()
-            try:
-                await self._heartbeat_task
-            except asyncio.CancelledError:
-                pass
-        # Signal end of stream
-        await self.queue.put(None)
         logger.debug(f"Streaming session {self.session_id} stopped")
 
-    async def _heartbeat_loop(self) -> None:
-        """Send periodic heartbeat to keep connection alive."""
-        while self.is_active:
-            try:
-                await asyncio.sleep(self.heartbeat_interval)
-                if self.is_active:
-                    await self.queue.put(StreamEvent(
-                        type=StreamEventType.PING,
-                        data={"timestamp": time.time()}
-                    ))
-            except asyncio.CancelledError:
-                break
-
-    async def emit_message_start(self, metadata: Optional[dict] = None) -> None:
+    def emit_ping(self) -> str:
+        """Emit heartbeat event to keep proxies from closing the connection."""
+        return StreamEvent(
+            type=StreamEventType.PING,
+            data={"timestamp": time.time()}
+        ).to_sse()
+
+    def emit_message_start(self, metadata: Optional[dict] = None) -> str:
         """Emit message_start event."""
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.MESSAGE_START,
             data={
                 "message_id": self.message_id,
                 "session_id": self.session_id,
                 "metadata": metadata or {},
             }
-        ))
+        ).to_sse()
 
-    async def emit_content_start(
+    def emit_content_start(
         self,
         index: int,
         content_type: str = "text",
         metadata: Optional[dict] = None
-    ) -> None:
+    ) -> str:
         """Emit content_block_start event (Anthropic format)."""
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.CONTENT_BLOCK_START,
             data={
                 "index": index,
@@ -123,16 +112,16 @@ class StreamingSession:
                     **(metadata or {}),
                 },
             }
-        ))
+        ).to_sse()
 
-    async def emit_content_delta(
+    def emit_content_delta(
         self,
         index: int,
         delta: str,
         delta_type: str = "text_delta"
-    ) -> None:
+    ) -> str:
         """Emit content_block_delta event."""
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.CONTENT_BLOCK_DELTA,
             data={
                 "index": index,
@@ -141,27 +130,27 @@ class StreamingSession:
                     "text": delta,
                 }
             }
-        ))
+        ).to_sse()
 
-    async def emit_content_stop(self, index: int) -> None:
+    def emit_content_stop(self, index: int) -> str:
         """Emit content_block_stop event."""
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.CONTENT_BLOCK_STOP,
             data={"index": index}
-        ))
+        ).to_sse()
 
-    async def emit_message_delta(self, usage: dict) -> None:
+    def emit_message_delta(self, usage: dict) -> str:
         """Emit message_delta with usage info."""
         self.total_tokens = usage.get("total_tokens", 0)
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.MESSAGE_DELTA,
             data={"usage": usage}
-        ))
+        ).to_sse()
 
-    async def emit_message_stop(self, final_data: Optional[dict] = None) -> None:
+    def emit_message_stop(self, final_data: Optional[dict] = None) -> str:
         """Emit message_stop event."""
         elapsed = time.time() - self.start_time
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.MESSAGE_STOP,
             data={
                 "message_id": self.message_id,
@@ -172,11 +161,11 @@ class StreamingSession:
                 },
                 **(final_data or {}),
             }
-        ))
+        ).to_sse()
 
-    async def emit_error(self, error: str, code: str = "stream_error") -> None:
+    def emit_error(self, error: str, code: str = "stream_error") -> str:
         """Emit error event."""
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.ERROR,
             data={
                 "error": {
@@ -184,14 +173,14 @@ class StreamingSession:
                     "message": error,
                 }
             }
-        ))
+        ).to_sse()
 
-    async def emit_status(
+    def emit_status(
         self,
         status: str,
         message: str,
         details: Optional[dict] = None
-    ) -> None:
+    ) -> str:
         """Emit simple status event for frontend display.
 
         This is a simpler format than content_block events,
@@ -206,32 +195,14 @@ class StreamingSession:
             event: status
             data: {"type": "status", "status": "thinking", "message": "Đang xử lý..."}
         """
-        await self.queue.put(StreamEvent(
+        return StreamEvent(
             type=StreamEventType.STATUS,
             data={
                 "status": status,
                 "message": message,
                 "details": details or {},
             }
-        ))
-
-    async def iterate(self) -> AsyncGenerator[str, None]:
-        """Iterate over events as SSE strings."""
-        try:
-            while self.is_active or not self.queue.empty():
-                try:
-                    event = await asyncio.wait_for(
-                        self.queue.get(),
-                        timeout=self.timeout
-                    )
-                    if event is None:
-                        break
-                    yield event.to_sse()
-                except asyncio.TimeoutError:
-                    logger.warning(f"Streaming session {self.session_id} timed out")
-                    break
-        finally:
-            self.is_active = False
+        ).to_sse()
 
 
 async def run_sync_generator_async(
@@ -244,43 +215,30 @@ async def run_sync_generator_async(
     This is the recommended pattern for streaming from sync ML models.
     """
     queue: asyncio.Queue = asyncio.Queue()
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
 
     def run_sync():
         """Run sync generator and put results in queue."""
         try:
             gen = sync_gen_func(*args, **kwargs)
             for item in gen:
-                asyncio.run_coroutine_threadsafe(
-                    queue.put(("data", item)),
-                    loop
-                )
-            asyncio.run_coroutine_threadsafe(
-                queue.put(("done", None)),
-                loop
-            )
+                loop.call_soon_threadsafe(queue.put_nowait, ("data", item))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
         except Exception as e:
-            asyncio.run_coroutine_threadsafe(
-                queue.put(("error", str(e))),
-                loop
-            )
-
-    # Start sync generator in thread
-    import concurrent.futures
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-    future = executor.submit(run_sync)
-
-    try:
-        while True:
-            msg_type, data = await queue.get()
-            if msg_type == "done":
-                break
-            elif msg_type == "error":
-                raise Exception(data)
-            else:
-                yield data
-    finally:
-        executor.shutdown(wait=False)
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", str(e)))
+
+    # Start sync generator on the shared executor
+    from services.executor import get_executor
+    get_executor().submit(run_sync)
+
+    while True:
+        msg_type, data = await queue.get()
+        if msg_type == "done":
+            break
+        elif msg_type == "error":
+            raise Exception(data)
+        else:
+            yield data
 
 
 def create_sse_response_headers() -> dict:
@@ -4,6 +4,7 @@ MedXrayChat Backend - FastAPI Application Entry Point
 Includes structured logging, request tracking middleware,
 and centralized exception handling.
 """
+import asyncio
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -17,7 +18,7 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from loguru import logger
 
 from core.config import settings
-from core.database import close_db
+from core.database import close_db, warm_db_pool
 from core.rate_limit import limiter
 from core.logging import setup_logging
 from core.exceptions import (
@@ -27,7 +28,7 @@ from core.exceptions import (
 )
 from middleware.request_tracking import RequestTrackingMiddleware
 from api.v1 import router as api_v1_router
-from services.executor import shutdown_executor
+from services.executor import get_executor, shutdown_executor
 
 
 class CORSPreflightMiddleware(BaseHTTPMiddleware):
@@ -53,6 +54,7 @@ async def lifespan(app: FastAPI):
         json_output=settings.LOG_JSON_FORMAT,
         log_level=settings.LOG_LEVEL,
         log_file=settings.LOG_FILE,
+        debug=settings.DEBUG,
     )
 
     # Startup
@@ -65,11 +67,14 @@ async def lifespan(app: FastAPI):
     # Initialize database
     # Note: Using init.sql for schema, so we don't need to create tables here
     # await init_db()
-    logger.info("Database connected")
+    try:
+        await warm_db_pool()
+        logger.info("Database connected")
+    except Exception as e:
+        logger.error(f"Database warm-up failed: {e}")
 
     # Preload AI models if configured
     if settings.PRELOAD_AI_MODELS:
-        import asyncio
         asyncio.create_task(_preload_ai_models())
     else:
         logger.info("AI services will be loaded on first request")
@@ -80,20 +85,25 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down...")
     shutdown_executor()
     await close_db()
+    await logger.complete()  # Drain enqueued log records
 
 
 async def _preload_ai_models():
     """Preload AI models in background task."""
     from services import get_ai_service
-    import asyncio
+    from api.v1.endpoints.streaming import get_streaming_service
     
     # Small delay to let server start accepting requests first
     await asyncio.sleep(2)
     
     logger.info("Preloading AI models...")
     try:
-        # This triggers lazy initialization of both YOLO and Qwen services
-        ai_service = get_ai_service()
+        # Triggers lazy initialization of YOLO and Qwen; model loading is
+        # blocking, so run it on the executor rather than the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            get_executor(), lambda: (get_ai_service(), get_streaming_service())
+        )
         logger.info("AI models preloaded successfully")
     except Exception as e:
         logger.error(f"Failed to preload AI models: {e}")
@@ -172,4 +182,6 @@ if __name__ == "__main__":
         port=settings.PORT,
         reload=settings.DEBUG,
         log_level="debug" if settings.DEBUG else "info",
+        loop="uvloop",
+        http="httptools",
     )
@@ -4,7 +4,7 @@ MedXrayChat Backend - SQLAlchemy Models
 import uuid
 from datetime import datetime
 from typing import Optional, List
-from sqlalchemy import String, Text, Integer, Boolean, Float, ForeignKey, JSON, DateTime
+from sqlalchemy import String, Text, Integer, Boolean, Float, ForeignKey, JSON, DateTime, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -47,6 +47,8 @@ class Study(Base):
     study_date: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     modality: Mapped[str] = mapped_column(String(16), default="CR")
     description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Denormalized count of images, bumped on upload (images only go away with the study)
+    image_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     user_id: Mapped[Optional[uuid.UUID]] = mapped_column(
         UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True
     )
@@ -95,7 +97,11 @@ class AIResult(Base):
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
     )
     image_id: Mapped[uuid.UUID] = mapped_column(
-        UUID(as_uuid=True), ForeignKey("images.id", ondelete="CASCADE"), index=True
+        UUID(as_uuid=True), ForeignKey("images.id", ondelete="CASCADE")
+    )
+    # Denormalized owner so per-user counts skip the Image -> Study join
+    user_id: Mapped[Optional[uuid.UUID]] = mapped_column(
+        UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"), nullable=True
     )
     # Detection results as JSON
     yolo_detections: Mapped[dict] = mapped_column(JSON, default=list)
@@ -113,6 +119,21 @@ class AIResult(Base):
     image: Mapped["Image"] = relationship(back_populates="ai_results")
 
 
+# Latest result per image is read straight off this index, no sort step
+Index(
+    "idx_ai_results_image_created",
+    AIResult.image_id,
+    AIResult.created_at.desc(),
+)
+
+# Dashboard "analyses today" count per user
+Index(
+    "idx_ai_results_user_created",
+    AIResult.user_id,
+    AIResult.created_at,
+)
+
+
 class ChatSession(Base):
     """Chat session for AI-assisted diagnosis."""
     __tablename__ = "chat_sessions"
@@ -137,7 +158,9 @@ class ChatSession(Base):
     study: Mapped["Study"] = relationship(back_populates="chat_sessions")
     user: Mapped[Optional["User"]] = relationship(back_populates="chat_sessions")
     messages: Mapped[List["ChatMessage"]] = relationship(
-        back_populates="session", cascade="all, delete-orphan"
+        back_populates="session",
+        cascade="all, delete-orphan",
+        order_by="ChatMessage.created_at",
     )
 
 
@@ -149,7 +172,7 @@ class ChatMessage(Base):
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4
     )
     session_id: Mapped[uuid.UUID] = mapped_column(
-        UUID(as_uuid=True), ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True
+        UUID(as_uuid=True), ForeignKey("chat_sessions.id", ondelete="CASCADE")
     )
     role: Mapped[str] = mapped_column(String(20))  # 'user', 'assistant', 'system'
     content: Mapped[str] = mapped_column(Text)
@@ -164,6 +187,14 @@ class ChatMessage(Base):
     session: Mapped["ChatSession"] = relationship(back_populates="messages")
 
 
+# History reads are "WHERE session_id = ? ORDER BY created_at [DESC] LIMIT n"
+Index(
+    "idx_chat_messages_session_created",
+    ChatMessage.session_id,
+    ChatMessage.created_at,
+)
+
+
 class DiagnosisReport(Base):
     """Diagnosis report generated from AI analysis."""
     __tablename__ = "diagnosis_reports"
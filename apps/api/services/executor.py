@@ -2,9 +2,11 @@
 MedXrayChat Backend - Shared Thread Pool Executor
 
 Provides a shared ThreadPoolExecutor for AI inference operations
-to avoid creating multiple independent pools.
+to avoid creating multiple independent pools, plus a small process pool
+for CPU-bound image conversion that would otherwise hold the GIL.
 """
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Optional
 from loguru import logger
 
@@ -12,6 +14,7 @@ from core.config import settings
 
 
 _executor: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
 
 
 def get_executor() -> ThreadPoolExecutor:
@@ -30,6 +33,23 @@ def get_executor() -> ThreadPoolExecutor:
     return _executor
 
 
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the shared ProcessPoolExecutor for CPU-bound conversions.
+
+    Workers are spawned rather than forked so they never inherit the
+    parent's CUDA context or model weights. Worker count is configurable
+    via DICOM_PROCESS_WORKERS setting.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.DICOM_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"Created ProcessPoolExecutor with {settings.DICOM_PROCESS_WORKERS} workers")
+    return _process_pool
+
+
 def shutdown_executor(wait: bool = True) -> None:
     """Shutdown the shared executor.
 
@@ -38,9 +58,12 @@ def shutdown_executor(wait: bool = True) -> None:
     Args:
         wait: If True, wait for all pending tasks to complete.
     """
-    global _executor
+    global _executor, _process_pool
     if _executor is not None:
         logger.info("Shutting down ThreadPoolExecutor...")
         _executor.shutdown(wait=wait)
         _executor = None
         logger.info("ThreadPoolExecutor shutdown complete")
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=wait)
+        _process_pool = None
@@ -4,14 +4,42 @@ MedXrayChat Backend - Model Versioning Service
 Supports multiple model versions with A/B testing capability.
 """
 import random
-from typing import Optional, Dict, Any, List
+import hashlib
+from typing import Optional, Dict, Any, List, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
 from loguru import logger
+import orjson
 
 from core.config import settings
 
 
+def build_alias_table(weights: List[float]) -> Tuple[Tuple[float, ...], Tuple[int, ...]]:
+    """Build a Walker alias table (Vose's method) for O(1) weighted sampling.
+    
+    Returns:
+        (prob, alias) where index i is kept with probability prob[i],
+        otherwise alias[i] is chosen.
+    """
+    n = len(weights)
+    total = sum(weights)
+    scaled = [w * n / total for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    
+    # Leftovers are 1.0 up to float error
+    return tuple(prob), tuple(alias)
+
+
 @dataclass
 class ModelVersion:
     """Model version metadata."""
@@ -33,6 +61,10 @@ class ModelRegistry:
     def __init__(self):
         self.models: Dict[str, ModelVersion] = {}
         self._ab_test_enabled: bool = False
+        # model_type -> (candidates, alias prob, alias idx, fallback), rebuilt lazily after writes
+        self._selection: Dict[str, Tuple[tuple, tuple, tuple, ModelVersion]] = {}
+        # Serialized read payloads (body, ETag) keyed by model_type / "__stats__"
+        self._serialized: Dict[Optional[str], Tuple[bytes, str]] = {}
         self._load_default_models()
     
     def _load_default_models(self) -> None:
@@ -68,15 +100,45 @@ class ModelRegistry:
             }
         ))
     
+    def _invalidate(self) -> None:
+        """Drop derived selection tables and serialized payloads after a write."""
+        self._selection.clear()
+        self._serialized.clear()
+    
+    def _serialize(self, key: Optional[str], payload: Any) -> Tuple[bytes, str]:
+        body = orjson.dumps(payload)
+        entry = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+        self._serialized[key] = entry
+        return entry
+    
+    def get_serialized_models(self, model_type: Optional[str] = None) -> Tuple[bytes, str]:
+        """JSON body and ETag for ``list_models(model_type)``, cached until the next write."""
+        entry = self._serialized.get(model_type)
+        if entry is None:
+            entry = self._serialize(model_type, [
+                ModelVersionSchema.model_validate(m).model_dump()
+                for m in self.list_models(model_type)
+            ])
+        return entry
+    
+    def get_serialized_statistics(self) -> Tuple[bytes, str]:
+        """JSON body and ETag for ``get_statistics()``, cached until the next write."""
+        entry = self._serialized.get("__stats__")
+        if entry is None:
+            entry = self._serialize("__stats__", self.get_statistics())
+        return entry
+    
     def register(self, model: ModelVersion) -> None:
         """Register a new model version."""
         self.models[model.id] = model
+        self._invalidate()
         logger.info(f"Registered model: {model.id} ({model.name})")
     
     def unregister(self, model_id: str) -> bool:
         """Unregister a model version."""
         if model_id in self.models:
             del self.models[model_id]
+            self._invalidate()
             logger.info(f"Unregistered model: {model_id}")
             return True
         return False
@@ -115,42 +177,56 @@ class ModelRegistry:
             if model and model.model_type == model_type and model.is_active:
                 return model
         
+        table = self._selection.get(model_type)
+        if table is None:
+            table = self._build_selection(model_type)
+            if table is None:
+                return None
+        candidates, prob, alias, fallback = table
+        
+        # A/B testing logic: O(1) alias-method draw
+        if self._ab_test_enabled and prob:
+            i = random.randrange(len(candidates))
+            return candidates[i] if random.random() < prob[i] else candidates[alias[i]]
+        
+        # Return default or first available
+        return fallback
+    
+    def _build_selection(self, model_type: str) -> Optional[Tuple[tuple, tuple, tuple, ModelVersion]]:
+        """Precompute the candidates and alias table for a model type."""
         # Get active models of this type
-        candidates = [
+        candidates = tuple(
             m for m in self.models.values()
             if m.model_type == model_type and m.is_active
-        ]
+        )
         
         if not candidates:
             return None
         
-        # A/B testing logic
-        if self._ab_test_enabled and len(candidates) > 1:
-            # Weighted random selection
-            total_weight = sum(m.traffic_weight for m in candidates)
-            if total_weight > 0:
-                rand = random.random() * total_weight
-                cumulative = 0
-                for model in candidates:
-                    cumulative += model.traffic_weight
-                    if rand <= cumulative:
-                        return model
+        prob: tuple = ()
+        alias: tuple = ()
+        weights = [m.traffic_weight for m in candidates]
+        if len(candidates) > 1 and sum(weights) > 0:
+            prob, alias = build_alias_table(weights)
         
-        # Return default or first available
-        default = next((m for m in candidates if m.is_default), None)
-        return default or candidates[0]
+        fallback = next((m for m in candidates if m.is_default), None) or candidates[0]
+        table = (candidates, prob, alias, fallback)
+        self._selection[model_type] = table
+        return table
     
     def set_traffic_weight(self, model_id: str, weight: float) -> bool:
         """Set traffic weight for A/B testing."""
         model = self.get(model_id)
         if model:
             model.traffic_weight = max(0.0, min(1.0, weight))
+            self._invalidate()
             return True
         return False
     
     def enable_ab_testing(self, enabled: bool = True) -> None:
         """Enable or disable A/B testing."""
         self._ab_test_enabled = enabled
+        self._invalidate()
         logger.info(f"A/B testing {'enabled' if enabled else 'disabled'}")
     
     def set_default(self, model_id: str) -> bool:
@@ -165,6 +241,7 @@ class ModelRegistry:
                 m.is_default = False
         
         model.is_default = True
+        self._invalidate()
         return True
     
     def get_statistics(self) -> Dict[str, Any]:
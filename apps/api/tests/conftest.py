@@ -0,0 +1,54 @@
+"""
+MedXrayChat Backend - Shared test fixtures
+"""
+from typing import Any, Callable
+
+import pytest
+
+
+@pytest.fixture
+def count_queries() -> Callable[[Any], list]:
+    """Record every statement a (mocked) session sends to the database.
+
+    Returns a function that wraps ``db.execute`` and the raw asyncpg
+    ``driver_connection.fetch`` reached through ``db.connection()``, and
+    hands back the list the statements are appended to.
+    """
+    def wrap(db: Any) -> list:
+        queries: list = []
+        wrapped_drivers: set = set()
+
+        execute = db.execute
+
+        async def counted_execute(statement, *args, **kwargs):
+            queries.append(statement)
+            return await execute(statement, *args, **kwargs)
+
+        connection = db.connection
+
+        async def counted_connection(*args, **kwargs):
+            conn = await connection(*args, **kwargs)
+            get_raw_connection = conn.get_raw_connection
+
+            async def counted_raw_connection():
+                raw_conn = await get_raw_connection()
+                driver = raw_conn.driver_connection
+                if id(driver) not in wrapped_drivers:
+                    fetch = driver.fetch
+
+                    async def counted_fetch(sql, *args, **kwargs):
+                        queries.append(sql)
+                        return await fetch(sql, *args, **kwargs)
+
+                    driver.fetch = counted_fetch
+                    wrapped_drivers.add(id(driver))
+                return raw_conn
+
+            conn.get_raw_connection = counted_raw_connection
+            return conn
+
+        db.execute = counted_execute
+        db.connection = counted_connection
+        return queries
+
+    return wrap
@@ -0,0 +1,37 @@
+"""
+MedXrayChat Backend - Logging formatter tests
+"""
+import io
+import re
+
+import orjson
+from loguru import logger
+
+from core.logging import json_formatter
+
+
+def _emit_json_line(message: str, **extra) -> dict:
+    """Log one record through json_formatter and parse the written line."""
+    sink = io.StringIO()
+    handler_id = logger.add(sink, format=json_formatter, level="DEBUG")
+    try:
+        logger.bind(**extra).info(message)
+    finally:
+        logger.remove(handler_id)
+    return orjson.loads(sink.getvalue())
+
+
+def test_json_timestamp_is_iso8601_utc():
+    entry = _emit_json_line("hello")
+
+    assert re.fullmatch(
+        r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z", entry["timestamp"]
+    )
+
+
+def test_json_line_keeps_braces_and_extra_fields():
+    entry = _emit_json_line("payload {not_a_field}", study="abc")
+
+    assert entry["message"] == "payload {not_a_field}"
+    assert entry["study"] == "abc"
+    assert "_json" not in entry
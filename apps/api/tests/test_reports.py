@@ -0,0 +1,107 @@
+"""
+MedXrayChat Backend - Report generation tests
+"""
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from sqlalchemy.sql.dml import Insert
+
+from api.v1.endpoints import reports
+
+
+def _scalar_result(value) -> MagicMock:
+    result = MagicMock()
+    result.scalar_one_or_none.return_value = value
+    result.scalar_one.return_value = value
+    return result
+
+
+def _mock_session(*results, rows=()) -> MagicMock:
+    """Session whose execute() yields ``results`` in order and whose raw
+    asyncpg connection returns ``rows`` from fetch()."""
+    raw_conn = MagicMock()
+    raw_conn.driver_connection.fetch = AsyncMock(return_value=list(rows))
+    conn = MagicMock()
+    conn.get_raw_connection = AsyncMock(return_value=raw_conn)
+
+    db = MagicMock()
+    db.execute = AsyncMock(side_effect=[_scalar_result(r) for r in results])
+    db.connection = AsyncMock(return_value=conn)
+    db.commit = AsyncMock()
+    return db
+
+
+async def _generate(db, study_id):
+    with patch.object(reports, "get_ai_service"):
+        return await reports.generate_ai_report.__wrapped__(
+            request=MagicMock(),
+            study_id=study_id,
+            current_user=SimpleNamespace(id=uuid.uuid4()),
+            db=db,
+        )
+
+
+@pytest.mark.asyncio
+async def test_generate_ai_report_uses_decoded_jsonb_detections():
+    study_id = uuid.uuid4()
+    study = SimpleNamespace(id=study_id, images=[SimpleNamespace(id=uuid.uuid4())])
+    report = SimpleNamespace(id=uuid.uuid4())
+
+    # The asyncpg dialect's jsonb codec already decodes fused_detections
+    detections = [
+        {"class_name": "Cardiomegaly", "confidence": 0.9},
+        {"class_name": "Pleural effusion", "confidence": 0.7},
+    ]
+    db = _mock_session(study, report, rows=[("Bóng tim to.", detections)])
+    execute = db.execute
+
+    result = await _generate(db, study_id)
+
+    assert result is report
+    insert_stmt = execute.await_args_list[1].args[0]
+    values = insert_stmt.compile().params
+    assert "Cardiomegaly" in values["findings"]
+    assert values["impression"] != reports._generate_impression([])
+    db.commit.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_generate_ai_report_query_count(count_queries):
+    study_id = uuid.uuid4()
+    study = SimpleNamespace(
+        id=study_id, images=[SimpleNamespace(id=uuid.uuid4()) for _ in range(3)]
+    )
+    db = _mock_session(study, SimpleNamespace(id=uuid.uuid4()), rows=[("", [])] * 3)
+    queries = count_queries(db)
+
+    await _generate(db, study_id)
+
+    # Study + images in one load, latest results in one fetch, whatever the
+    # image count; the report INSERT is the only write
+    reads = [q for q in queries if not isinstance(q, Insert)]
+    assert len(reads) <= 2
+    assert len(queries) - len(reads) == 1
+
+
+@pytest.mark.asyncio
+async def test_export_report_pdf_query_count(count_queries):
+    user_id = uuid.uuid4()
+    report = SimpleNamespace(
+        id=uuid.uuid4(),
+        study_id=uuid.uuid4(),
+        study=SimpleNamespace(user_id=user_id),
+    )
+    db = _mock_session(report)
+    queries = count_queries(db)
+
+    with patch.object(reports, "_generate_pdf", return_value=b"%PDF-1.4"):
+        response = await reports.export_report_pdf(
+            report_id=report.id,
+            current_user=SimpleNamespace(id=user_id),
+            db=db,
+        )
+
+    assert response.body == b"%PDF-1.4"
+    assert len(queries) <= 2
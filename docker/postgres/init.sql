@@ -29,6 +29,8 @@ CREATE TABLE studies (
     study_date TIMESTAMP WITH TIME ZONE,
     modality VARCHAR(16) DEFAULT 'CR',
     description TEXT,
+    -- Number of images in the study (denormalized, maintained on upload)
+    image_count INTEGER NOT NULL DEFAULT 0,
     user_id UUID REFERENCES users(id) ON DELETE SET NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
@@ -59,6 +61,8 @@ CREATE INDEX idx_images_study ON images(study_id);
 CREATE TABLE ai_results (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     image_id UUID REFERENCES images(id) ON DELETE CASCADE,
+    -- Owner of the analysed image (denormalized for per-user stats)
+    user_id UUID REFERENCES users(id) ON DELETE SET NULL,
     -- YOLO detections: [{class_id, class_name, bbox: [x1,y1,x2,y2], confidence}, ...]
     yolo_detections JSONB DEFAULT '[]'::jsonb,
     -- Qwen-VL detections (if any)
@@ -74,7 +78,8 @@ CREATE TABLE ai_results (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
-CREATE INDEX idx_ai_results_image ON ai_results(image_id);
+CREATE INDEX idx_ai_results_image_created ON ai_results(image_id, created_at DESC);
+CREATE INDEX idx_ai_results_user_created ON ai_results(user_id, created_at);
 
 -- Chat Sessions
 CREATE TABLE chat_sessions (
@@ -105,7 +110,7 @@ CREATE TABLE chat_messages (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
-CREATE INDEX idx_chat_messages_session ON chat_messages(session_id);
+CREATE INDEX idx_chat_messages_session_created ON chat_messages(session_id, created_at);
 CREATE INDEX idx_chat_messages_created ON chat_messages(created_at);
 
 -- Diagnosis Reports (generated from AI analysis)
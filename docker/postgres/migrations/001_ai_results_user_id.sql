@@ -0,0 +1,23 @@
+-- MedXrayChat Database Migration
+-- Adds the denormalized ai_results.user_id (owner of the analysed image) to
+-- databases created before it was part of init.sql, and backfills it.
+-- Safe to re-run. Apply with:
+--   psql "$DATABASE_URL" -f docker/postgres/migrations/001_ai_results_user_id.sql
+
+BEGIN;
+
+ALTER TABLE ai_results
+    ADD COLUMN IF NOT EXISTS user_id UUID REFERENCES users(id) ON DELETE SET NULL;
+
+-- Owner comes from images -> studies
+UPDATE ai_results r
+SET user_id = s.user_id
+FROM images i
+JOIN studies s ON s.id = i.study_id
+WHERE r.image_id = i.id
+  AND r.user_id IS NULL
+  AND s.user_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_ai_results_user_created ON ai_results(user_id, created_at);
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- MedXrayChat Database Migration
+-- Adds the denormalized studies.image_count to databases created before it
+-- was part of init.sql, and backfills it from images.
+-- Safe to re-run. Apply with:
+--   psql "$DATABASE_URL" -f docker/postgres/migrations/002_studies_image_count.sql
+
+BEGIN;
+
+ALTER TABLE studies
+    ADD COLUMN IF NOT EXISTS image_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE studies s
+SET image_count = c.n
+FROM (SELECT study_id, count(*) AS n FROM images GROUP BY study_id) c
+WHERE c.study_id = s.id
+  AND s.image_count <> c.n;
+
+COMMIT;
@@ -0,0 +1,30 @@
+-- MedXrayChat Database Migration
+-- Adds the (image_id, created_at) and (session_id, created_at) composite
+-- indexes to databases created before they were part of init.sql / the
+-- models, and drops the single-column indexes they replace.
+-- Safe to re-run. Apply with:
+--   psql "$DATABASE_URL" -f docker/postgres/migrations/003_composite_indexes.sql
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_ai_results_image_created ON ai_results(image_id, created_at DESC);
+DROP INDEX IF EXISTS idx_ai_results_image;
+-- Name create_all gave the old index=True column index
+DROP INDEX IF EXISTS ix_ai_results_image_id;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_created ON chat_messages(session_id, created_at);
+DROP INDEX IF EXISTS idx_chat_messages_session;
+DROP INDEX IF EXISTS ix_chat_messages_session_id;
+
+-- image_annotations is created by the app (create_all), not init.sql
+DO $$
+BEGIN
+    IF to_regclass('image_annotations') IS NOT NULL THEN
+        CREATE INDEX IF NOT EXISTS idx_image_annotations_image_created
+            ON image_annotations(image_id, created_at);
+        DROP INDEX IF EXISTS ix_image_annotations_image_id;
+    END IF;
+END
+$$;
+
+COMMIT;